@@ -2,6 +2,8 @@ from pydantic import BaseModel, Field
 from typing import Optional, Dict
 from datetime import datetime
 
+ALERT_MODES = ("new", "price_drop", "both")
+
 class Filters(BaseModel):
     category: Optional[str] = None
     price_min: Optional[float] = None
@@ -10,6 +12,7 @@ class Filters(BaseModel):
     radius: Optional[int] = 25
     condition: Optional[str] = "Any"
     date_range: Optional[str] = "any"  # any|last_24h|last_3d|last_7d
+    sort_by: Optional[str] = "date_desc"  # date_desc|price_asc|price_desc
 
 class SavedSearch(BaseModel):
     id: Optional[str] = Field(default=None, alias="_id")
@@ -17,6 +20,12 @@ class SavedSearch(BaseModel):
     filters: Filters
     notifications_enabled: bool = True
     notifications: Dict[str, bool] = {"email": False, "push": False}
+    alert_mode: str = "new"  # ALERT_MODES: о новых объявлениях и/или о снижении цены
+    priority: float = 1.0    # доля в общем бюджете сканов (SCAN_BUDGET_PER_HOUR)
+    # заполняет планировщик: EWMA новых объявлений в час, текущий интервал и ожидаемое число новых за скан
+    rate_per_hour: Optional[float] = None
+    interval_minutes: Optional[float] = None
+    predicted_yield: Optional[float] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Listing(BaseModel):
@@ -30,6 +39,7 @@ class Listing(BaseModel):
     url: str
     published_at: datetime
     condition: Optional[str] = None
+    description: Optional[str] = None
 
 class SearchRequest(BaseModel):
     query: Optional[str] = None
@@ -41,6 +51,9 @@ class SearchRequest(BaseModel):
     condition: Optional[str] = "Any"
     date_range: Optional[str] = "any"
     sort_by: Optional[str] = "date_desc"
+    timeout: Optional[float] = None  # секунд; None = SEARCH_TIMEOUT
+    limit: Optional[int] = None      # top-k для /api/search; сколько собрать для /api/search/stream
+    enrich: bool = False             # открыть страницы объявлений: реальные дата, состояние, описание, город
 
 class AuthStatus(BaseModel):
     authenticated: bool
@@ -0,0 +1,30 @@
+import time
+
+
+class TokenBucket:
+    """Классический token bucket: `rate` токенов в секунду, не больше `burst` в запасе."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._ts = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def wait_time(self, n: float = 1.0) -> float:
+        """Через сколько секунд наберётся n токенов (0 — уже есть)."""
+        self._refill()
+        if self.tokens >= n or self.rate <= 0:
+            return 0.0 if self.tokens >= n else float("inf")
+        return (n - self.tokens) / self.rate
@@ -0,0 +1,89 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.metrics import registry
+
+STAGE_SAMPLES = 2000  # сколько последних замеров хранить на стадию для перцентилей
+
+stage_seconds = registry.histogram("mpf_stage_seconds", "Duration of pipeline stages", ["stage"])
+
+# Трасса текущего запроса: список (стадия, секунды). Задаётся middleware при заголовке X-Trace;
+# дочерние задачи (wait_for, single-flight кэша) получают тот же список через копию контекста.
+_trace: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("mpf_trace", default=None)
+
+
+class StageTimings:
+    """
+    Длительности стадий (launch/context/goto/wait/extract, Mongo, уведомления):
+    последние замеры для p50/p95 в бенчмарке и гистограмма mpf_stage_seconds для /api/metrics.
+    """
+
+    def __init__(self, keep: int = STAGE_SAMPLES):
+        self.keep = keep
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._totals: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage: str, seconds: float):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=self.keep)
+        samples.append(seconds)
+        self._counts[stage] = self._counts.get(stage, 0) + 1
+        self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+        stage_seconds.observe(seconds, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+    def reset(self):
+        self._samples, self._counts, self._totals = {}, {}, {}
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for stage, samples in self._samples.items():
+            values = sorted(samples)
+
+            def pct(p: float) -> float:
+                return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1)
+
+            out[stage] = {
+                "count": self._counts[stage],
+                "p50_ms": pct(0.50),
+                "p95_ms": pct(0.95),
+                "max_ms": round(values[-1] * 1000, 1),
+                "total_s": round(self._totals[stage], 3),
+            }
+        return out
+
+
+stage_timings = StageTimings()
+span = stage_timings.span
+
+
+def start_trace() -> List[Tuple[str, float]]:
+    """Включает трассировку стадий для текущего контекста (запроса)."""
+    trace: List[Tuple[str, float]] = []
+    _trace.set(trace)
+    return trace
+
+
+def server_timing(trace: List[Tuple[str, float]]) -> str:
+    """Заголовок Server-Timing: стадии суммируются, порядок — по первому появлению."""
+    totals: Dict[str, List[float]] = {}
+    for stage, seconds in trace:
+        acc = totals.setdefault(stage, [0.0, 0])
+        acc[0] += seconds
+        acc[1] += 1
+    return ", ".join(f'{stage};dur={acc[0] * 1000:.1f};desc="x{acc[1]}"' for stage, acc in totals.items())
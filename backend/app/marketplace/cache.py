@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.jsonenc import dumps
+from app.core.metrics import errors_total
+from app.core.models import Filters
+from app.core.timing import span
+from app.marketplace.listing import Listing
+
+CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))                      # секунд
+CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_MB", "64")) * 1024 * 1024
+CACHE_MONGO = os.getenv("SEARCH_CACHE_MONGO", "1") not in ("0", "false", "False", "")
+
+_FILTER_DEFAULTS = {name: f.default for name, f in Filters.model_fields.items()}
+
+
+class _LeaderCancelled(Exception):
+    """Запрос, который вёл скрапинг, отменён (клиент отключился/таймаут) — ждущие повторяют сами."""
+
+
+def _norm(value: Any) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split()).lower()
+        return value or None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def canonical_key(query: Optional[str], filters: Optional[Dict[str, Any]]) -> str:
+    """
+    Канонический ключ поиска: регистр/пробелы в тексте не важны, пустые поля
+    и значения по умолчанию из Filters отбрасываются. SearchRequest.model_dump()
+    и filters сохранённого поиска дают одинаковый ключ для одного и того же поиска.
+    """
+    filters = filters or {}
+    parts = {}
+    for name, default in _FILTER_DEFAULTS.items():
+        value = _norm(filters.get(name))
+        if value is not None and value != _norm(default):
+            parts[name] = value
+    raw = json.dumps([_norm(query) or "", parts], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """
+    Кэш результатов поиска перед скрапером:
+      - TTL и LRU-вытеснение по бюджету памяти (размер — длина JSON);
+      - single-flight: одновременные одинаковые поиски ждут один скрапинг;
+      - опциональный второй уровень в Mongo (коллекция search_cache, TTL-индекс).
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db = None
+        self._entries: "OrderedDict[str, Tuple[float, int, List[Listing]]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._counters = {"hits": 0, "mongo_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "errors": 0}
+
+    async def attach_db(self, db):
+        """Включает Mongo-уровень; вызывается на старте, если Mongo настроен."""
+        if db is None or not CACHE_MONGO:
+            return
+        try:
+            await db.search_cache.create_index("expires_at", expireAfterSeconds=0)
+            self.db = db
+        except Exception as e:
+            print(f"[CACHE mongo disabled] {e}")
+
+    async def get_or_fetch(self, query: Optional[str], filters: Optional[Dict[str, Any]],
+                           fetch: Callable[[], Awaitable[List[Listing]]], fresh: bool = False) -> List[Listing]:
+        """
+        fresh=True — готовый результат не берётся (сканы сохранённых поисков: иначе скан внутри TTL
+        не увидит новых объявлений), но идущий скрапинг переиспользуется и кэш обновляется.
+        """
+        key = canonical_key(query, filters)
+
+        if not fresh:
+            items = self._get_local(key)
+            if items is not None:
+                self._counters["hits"] += 1
+                return items
+
+        while True:
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self._counters["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LeaderCancelled:
+                continue   # первый проснувшийся ждущий сам ведёт скрапинг, остальные ждут уже его
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            items = None if fresh else await self._get_mongo(key)
+            if items is not None:
+                self._counters["mongo_hits"] += 1
+            else:
+                self._counters["misses"] += 1
+                items = await fetch()
+                # пустой ответ обычно значит ошибку/таймаут скрапера — не кэшируем
+                if items:
+                    await self._put_mongo(key, items)
+            if items:
+                self._put_local(key, items)
+            fut.set_result(items)
+            return items
+        except asyncio.CancelledError:
+            # не fut.cancel(): CancelledError у ждущих уронил бы чужие запросы и сканы
+            fut.set_exception(_LeaderCancelled())
+            fut.exception()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # помечаем как полученное, если ждущих нет
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._counters["hits"] + self._counters["mongo_hits"] + self._counters["misses"]
+        hits = self._counters["hits"] + self._counters["mongo_hits"]
+        return {
+            **self._counters,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "ttl": self.ttl,
+            "mongo": self.db is not None,
+        }
+
+    # ------------------------------------------------------------------ local tier
+    def _get_local(self, key: str) -> Optional[List[Listing]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, items = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return items
+
+    def _put_local(self, key: str, items: List[Listing]):
+        size = len(dumps(items))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, items)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._counters["evictions"] += 1
+
+    def _drop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    # ------------------------------------------------------------------ mongo tier
+    async def _get_mongo(self, key: str) -> Optional[List[Listing]]:
+        if self.db is None:
+            return None
+        try:
+            with span("mongo_cache_get"):
+                doc = await self.db.search_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+            return [Listing.from_doc(x) for x in doc["listings"]] if doc else None
+        except Exception as e:
+            self._counters["errors"] += 1
+            errors_total.inc(where="cache_mongo")
+            print(f"[CACHE mongo get error] {e}")
+            return None
+
+    async def _put_mongo(self, key: str, items: List[Listing]):
+        if self.db is None:
+            return
+        try:
+            with span("mongo_cache_put"):
+                await self.db.search_cache.update_one(
+                    {"_id": key},
+                    {"$set": {"listings": [x.to_dict() for x in items], "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)}},
+                    upsert=True,
+                )
+        except Exception as e:
+            self._counters["errors"] += 1
+            errors_total.inc(where="cache_mongo")
+            print(f"[CACHE mongo put error] {e}")
+
+
+search_cache = SearchCache()
@@ -0,0 +1,337 @@
+import asyncio
+import os
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    from PIL import Image  # есть в requirements.txt; без него дубли не склеиваются (нечем подтвердить)
+except ImportError:
+    Image = None
+
+from app.core.timing import span
+from app.marketplace.listing import Listing
+
+DEDUP_ENABLED = os.getenv("DEDUP", "1") == "1"
+DEDUP_TITLE_THRESHOLD = float(os.getenv("DEDUP_TITLE_THRESHOLD", "0.8"))   # оценка Jaccard по MinHash
+DEDUP_PRICE_TOLERANCE = float(os.getenv("DEDUP_PRICE_TOLERANCE", "0.15"))  # ±15% цены при перевыкладке
+DEDUP_IMAGES = os.getenv("DEDUP_IMAGES", "1") == "1"                       # dHash превью (нужен Pillow)
+DEDUP_IMAGE_DISTANCE = int(os.getenv("DEDUP_IMAGE_DISTANCE", "6"))         # бит из 64
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "50000"))
+DEDUP_NOTIFY_HOURS = float(os.getenv("DEDUP_NOTIFY_HOURS", "24"))         # не уведомлять о той же вещи повторно
+BUCKET_LIMIT = 32            # последних объявлений на LSH-корзину: популярные заголовки не раздувают поиск
+IMAGE_FETCH_TIMEOUT = 5
+IMAGE_CONCURRENCY = 8
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4          # порог срабатывания LSH ≈ (1/16)^(1/4) ≈ 0.5, дальше проверка по подписи
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501)  # фиксированные перестановки: подписи сравнимы между перезапусками
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD_RE = re.compile(r"[^\w]+", re.UNICODE)
+# что продавцы дописывают при перевыкладке; на идентичность вещи не влияет.
+# Состояние («new», «used», «like new») сюда не входит: новая и б/у вещь — разные объявления.
+_FILLER_RE = re.compile(
+    r"\b(obo|firm|price drop(?:ped)?|reduced|must go|negotiable|asap|for sale|pickup only)\b"
+)
+
+Signature = Tuple[int, ...]
+
+
+def shingles(title: str, k: int = 4) -> FrozenSet[str]:
+    """
+    Символьные k-граммы заголовка без пунктуации, пробелов и «OBO»/«price drop»:
+    «Trek FX3 hybrid bike - OBO» == «Trek FX 3 hybrid bike», а «XM4» и «XM5» различаются.
+    """
+    text = _WORD_RE.sub("", _FILLER_RE.sub(" ", (title or "").lower()))
+    if len(text) <= k:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + k] for i in range(len(text) - k + 1))
+
+
+def minhash(tokens: FrozenSet[str]) -> Signature:
+    if not tokens:
+        return ()
+    hashes = [zlib.crc32(t.encode("utf-8")) for t in tokens]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+
+def similarity(a: Signature, b: Signature) -> float:
+    if not a or not b:
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def _bands(sig: Signature) -> List[Tuple[int, int]]:
+    return [(i, hash(sig[i * ROWS:(i + 1) * ROWS])) for i in range(BANDS)]
+
+
+def dhash(data: bytes) -> Optional[int]:
+    """64-битный difference hash картинки (9x8 в градациях серого)."""
+    if Image is None:
+        return None
+    try:
+        img = Image.open(BytesIO(data)).convert("L").resize((9, 8))
+    except Exception:
+        return None
+    px = list(img.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+class _Entry:
+    __slots__ = ("mid", "canonical", "sig", "price", "city", "image")
+
+    def __init__(self, mid: str, canonical: str, sig: Signature, price: float, city: str, image: Optional[int]):
+        self.mid, self.canonical, self.sig = mid, canonical, sig
+        self.price, self.city, self.image = price, city, image
+
+
+class DedupIndex:
+    """
+    In-memory индекс почти-дубликатов: MinHash заголовка + LSH-корзины, поиск кандидатов
+    за O(BANDS * BUCKET_LIMIT) независимо от размера индекса. Дубль = похожий заголовок, близкий dHash
+    превью, близкая цена и тот же город; без превью у обоих объявлений дублем не считается —
+    похожий заголовок за похожую цену ещё не значит, что это та же вещь того же продавца.
+    Все дубли сводятся к одному canonical marketplace_id — первому увиденному объявлению кластера.
+    Выдача схлопывается по кластерам (collapse), коллекция listings остаётся полной.
+    Отметки об уведомлениях — в Mongo (dedup_notified, TTL), общие для всех процессов.
+    """
+
+    def __init__(self, max_entries: int = DEDUP_MAX_ENTRIES, threshold: float = DEDUP_TITLE_THRESHOLD,
+                 images: bool = DEDUP_IMAGES):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.images = images and Image is not None
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        self._members: Dict[str, List[str]] = {}   # canonical -> marketplace_id кластера
+        self._image_cache: "OrderedDict[str, Optional[int]]" = OrderedDict()
+        self._notified: Dict[str, float] = {}   # без Mongo — отметки только этого процесса
+        self.db = None
+        self._counters = {"seen": 0, "duplicates": 0, "clusters": 0, "notify_suppressed": 0, "images": 0}
+
+    async def attach_db(self, db):
+        """Отметки об уведомлениях в Mongo; вызывается на старте, если Mongo настроен."""
+        if db is None:
+            return
+        try:
+            await db.dedup_notified.create_index("at", expireAfterSeconds=int(DEDUP_NOTIFY_HOURS * 3600))
+            self.db = db
+        except Exception as e:
+            print(f"[DEDUP mongo disabled] {e}")
+
+    def canonical_id(self, item: Listing) -> str:
+        """Canonical id объявления (индексирует его, если ещё не видели)."""
+        mid = item["marketplace_id"]
+        if not mid:
+            return ""
+        entry = self._entries.get(mid)
+        if entry is not None:
+            self._entries.move_to_end(mid)
+            return entry.canonical
+        return self._add(item, None).canonical
+
+    async def collapse(self, items: Sequence[Listing]) -> List[Listing]:
+        """Индексирует объявления скана и оставляет по одному на кластер (первое в выдаче)."""
+        await self.index(items)
+        if not DEDUP_ENABLED:
+            return list(items)
+        out, seen = [], set()
+        for item in items:
+            entry = self._entries.get(item["marketplace_id"])
+            cid = entry.canonical if entry is not None else item["url"]
+            if cid in seen:
+                continue
+            seen.add(cid)
+            out.append(item)
+        return out
+
+    async def index(self, items: Sequence[Listing]):
+        """Индексирует объявления скана (с dHash превью, если включён); выдачу не меняет."""
+        if not DEDUP_ENABLED or not items:
+            return
+        with span("dedup"):
+            images = await self._image_hashes(items) if self.images else {}
+            for item in items:
+                mid = item["marketplace_id"]
+                self._counters["seen"] += 1
+                if not mid:
+                    continue
+                if mid in self._entries:
+                    self._entries.move_to_end(mid)
+                elif self._add(item, images.get(item["image_url"])).canonical != mid:
+                    self._counters["duplicates"] += 1
+
+    async def claim_notifications(self, items: Sequence[Listing]) -> List[Listing]:
+        """
+        Объявления, о которых ещё не уведомляли в пределах DEDUP_NOTIFY_HOURS — по кластеру,
+        а не по marketplace_id: та же вещь из другого сохранённого поиска или перевыложенная
+        с новым id повторно не приходит. Отмечаются id всех известных объявлений кластера:
+        canonical у каждого процесса свой (первое увиденное им объявление), а id совпадают везде.
+        """
+        if not DEDUP_ENABLED or not items:
+            return list(items)
+        keyed, batch = [], set()
+        for item in items:
+            cid = self.canonical_id(item)
+            keys = {item["marketplace_id"] or item["url"], *self._members.get(cid, ())}
+            keyed.append((item, keys, bool(keys & batch)))
+            batch |= keys
+        taken = await self._claim_keys(sorted(batch))
+        out = []
+        for item, keys, repeated in keyed:
+            if repeated or keys & taken:
+                self._counters["notify_suppressed"] += 1
+            else:
+                out.append(item)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._counters, "entries": len(self._entries), "buckets": len(self._buckets),
+                "images_enabled": int(self.images)}
+
+    # ------------------------------------------------------------------ internals
+    def _add(self, item: Listing, image: Optional[int]) -> _Entry:
+        sig = minhash(shingles(item["title"]))
+        mid = item["marketplace_id"]
+        match = self._match(sig, item, image)
+        if match is None:
+            self._counters["clusters"] += 1
+        entry = _Entry(mid, match.canonical if match else mid, sig, item["price"], item["city"], image)
+        self._entries[mid] = entry
+        self._members.setdefault(entry.canonical, []).append(mid)
+        if sig:
+            for band in _bands(sig):
+                bucket = self._buckets.setdefault(band, [])
+                bucket.append(mid)
+                if len(bucket) > BUCKET_LIMIT:
+                    del bucket[0]
+        while len(self._entries) > self.max_entries:
+            self._evict()
+        return entry
+
+    def _match(self, sig: Signature, item: Listing, image: Optional[int]) -> Optional[_Entry]:
+        if not sig:
+            return None
+        checked = set()
+        best, best_sim = None, self.threshold
+        for band in _bands(sig):
+            for mid in self._buckets.get(band, ()):
+                if mid in checked:
+                    continue
+                checked.add(mid)
+                cand = self._entries.get(mid)
+                if cand is None:
+                    continue
+                sim = similarity(sig, cand.sig)
+                if sim >= best_sim and self._same_item(cand, item, image):
+                    best, best_sim = cand, sim
+        return best
+
+    async def _claim_keys(self, keys: List[str]) -> set:
+        """Отмечает ключи уведомлёнными; возвращает те, что уже были отмечены в пределах окна."""
+        if self.db is not None:
+            from pymongo import UpdateOne
+            from pymongo.errors import BulkWriteError
+
+            now = datetime.utcnow()
+            cutoff = now - timedelta(hours=DEDUP_NOTIFY_HOURS)
+            # свежая отметка не совпадает с фильтром -> upsert упирается в _id -> ключ уже занят
+            ops = [UpdateOne({"_id": k, "at": {"$lt": cutoff}}, {"$set": {"at": now}}, upsert=True) for k in keys]
+            try:
+                await self.db.dedup_notified.bulk_write(ops, ordered=False)
+                return set()
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if all(err.get("code") == 11000 for err in errors):
+                    return {keys[err["index"]] for err in errors}
+                print(f"[DEDUP notify error] {errors[:1]}")
+            except Exception as e:
+                print(f"[DEDUP notify error] {e}")
+        now = time.time()
+        window = DEDUP_NOTIFY_HOURS * 3600
+        taken = {k for k in keys if now - self._notified.get(k, 0.0) < window}
+        for k in keys:
+            if k not in taken:
+                self._notified[k] = now
+        if len(self._notified) > self.max_entries:
+            self._notified = {k: t for k, t in self._notified.items() if now - t < window}
+        return taken
+
+    @staticmethod
+    def _same_item(cand: _Entry, item: Listing, image: Optional[int]) -> bool:
+        # превью обязательно: заголовок + цена + город в одиночку склеивали разные вещи
+        if cand.image is None or image is None:
+            return False
+        if bin(cand.image ^ image).count("1") > DEDUP_IMAGE_DISTANCE:
+            return False
+        price, city = item["price"], item["city"]
+        if cand.city not in ("", "—") and city not in ("", "—") and cand.city != city:
+            return False
+        top = max(cand.price, price)
+        return top == 0 or abs(cand.price - price) <= top * DEDUP_PRICE_TOLERANCE
+
+    def _evict(self):
+        mid, entry = self._entries.popitem(last=False)
+        members = self._members.get(entry.canonical)
+        if members is not None:
+            try:
+                members.remove(mid)
+            except ValueError:
+                pass
+            if not members:
+                del self._members[entry.canonical]
+        if entry.sig:
+            for band in _bands(entry.sig):
+                bucket = self._buckets.get(band)
+                if bucket is not None:
+                    try:
+                        bucket.remove(mid)
+                    except ValueError:
+                        pass
+                    if not bucket:
+                        del self._buckets[band]
+
+    async def _image_hashes(self, items: Sequence[Listing]) -> Dict[str, Optional[int]]:
+        urls = {x["image_url"] for x in items if x["image_url"] and x["marketplace_id"] not in self._entries}
+        todo = [u for u in urls if u not in self._image_cache]
+        if todo:
+            sem = asyncio.Semaphore(IMAGE_CONCURRENCY)
+
+            async def one(url: str):
+                async with sem:
+                    self._image_cache[url] = await asyncio.to_thread(_fetch_dhash, url)
+                    self._counters["images"] += 1
+
+            await asyncio.gather(*(one(u) for u in todo))
+            while len(self._image_cache) > self.max_entries:
+                self._image_cache.popitem(last=False)
+        return {u: self._image_cache.get(u) for u in urls}
+
+
+_http = None  # requests.Session: keep-alive к CDN превью; создаётся при первой загрузке
+
+
+def _fetch_dhash(url: str) -> Optional[int]:
+    global _http
+    try:
+        if _http is None:
+            import requests
+            _http = requests.Session()
+        r = _http.get(url, timeout=IMAGE_FETCH_TIMEOUT)
+        r.raise_for_status()
+    except Exception:
+        return None
+    return dhash(r.content)
+
+
+dedup_index = DedupIndex()
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from pymongo import UpdateOne
+
+from app.core.metrics import errors_total
+from app.core.ratelimit import TokenBucket
+from app.core.timing import span
+from app.marketplace.lean import track_page
+from app.marketplace.listing import Listing
+from app.marketplace.scanner import FB_BASE, SessionBlocked, browser_pool, is_blocked
+from app.marketplace.session import session_pool
+
+ENRICH_TABS = int(os.getenv("ENRICH_TABS", "4"))                     # вкладок в одном контексте
+ENRICH_RATE = float(os.getenv("ENRICH_RATE_PER_SEC", "2"))           # страниц объявлений в секунду на процесс
+ENRICH_MAX_ITEMS = int(os.getenv("ENRICH_MAX_ITEMS", "30"))          # сколько объявлений выдачи обогащать
+ENRICH_CACHE_MAX = int(os.getenv("ENRICH_CACHE_MAX", "20000"))       # записей в памяти
+ENRICH_CACHE_DAYS = int(os.getenv("ENRICH_CACHE_DAYS", "30"))        # TTL коллекции listing_details
+ITEM_URL = os.getenv("MARKETPLACE_ITEM", FB_BASE + "/marketplace/item/{id}/")
+PAGE_TIMEOUT_MS = 20000
+DESCRIPTION_MAX = 2000
+
+# Текст страницы, og:description и creation_time из встроенного JSON — одним evaluate.
+_DETAIL_JS = """
+() => {
+    const meta = name => (document.querySelector(`meta[property="${name}"]`) || {}).content || "";
+    const ts = document.documentElement.innerHTML.match(/"creation_time":(\\d{9,11})/);
+    return [(document.body && document.body.innerText || "").slice(0, 20000), meta("og:description"), ts ? ts[1] : ""];
+}
+"""
+
+_UNITS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400}
+_LISTED_RE = re.compile(
+    r"Listed\s+(?:(?:over\s+|about\s+)?(an?|\d+)\s+(minute|hour|day|week|month|year)s?\s+ago|(yesterday)|just now)"
+    r"(?:\s+in\s+([^\n·]+))?",
+    re.I,
+)
+_CONDITION_RE = re.compile(r"Condition\s*\n?\s*(?:Used\s*-\s*)?(New|Like New|Good|Fair)\b", re.I)
+_DESCRIPTION_RE = re.compile(r"(?:Seller's description|Description)\s*\n+(.+?)(?:\n\s*\n|$)", re.S)
+
+
+def parse_detail(text: str, og_description: str = "", creation_time: str = "",
+                 now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Поля со страницы объявления: published_at (ISO, UTC), condition (как в фильтрах UI),
+    description, city (местоположение продавца). Чего нет на странице — нет и в результате.
+    """
+    now = now or datetime.utcnow()
+    out: Dict[str, str] = {}
+    listed = _LISTED_RE.search(text or "")
+    if creation_time:
+        out["published_at"] = datetime.utcfromtimestamp(int(creation_time)).isoformat()
+    elif listed:
+        amount, unit, yesterday = listed.group(1), listed.group(2), listed.group(3)
+        if yesterday:
+            ago = 86400
+        elif unit:
+            ago = (1 if amount.lower() in ("a", "an") else int(amount)) * _UNITS[unit.lower()]
+        else:
+            ago = 0
+        out["published_at"] = (now - timedelta(seconds=ago)).isoformat()
+    if listed and listed.group(4):
+        out["city"] = listed.group(4).strip()
+    condition = _CONDITION_RE.search(text or "")
+    if condition:
+        out["condition"] = condition.group(1).title()
+    description = og_description.strip()
+    if not description:
+        m = _DESCRIPTION_RE.search(text or "")
+        description = m.group(1).strip() if m else ""
+    if description:
+        out["description"] = description[:DESCRIPTION_MAX]
+    return out
+
+
+class DetailEnricher:
+    """
+    Обогащение выдачи со страниц /marketplace/item/<id>: ENRICH_TABS вкладок одного контекста
+    разбирают общую очередь, общий TokenBucket держит темп не выше ENRICH_RATE страниц/с.
+    Результат кэшируется по marketplace_id (память + коллекция listing_details),
+    одновременные запросы одного объявления ждут одну загрузку — страница не открывается дважды.
+    """
+
+    def __init__(self, tabs: int = ENRICH_TABS, rate: float = ENRICH_RATE, max_entries: int = ENRICH_CACHE_MAX):
+        self.tabs = max(1, tabs)
+        self.max_entries = max_entries
+        self.bucket = TokenBucket(rate, burst=self.tabs)
+        self.db = None
+        self._cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._counters = {"hits": 0, "mongo_hits": 0, "fetched": 0, "failed": 0, "blocked": 0, "unavailable": 0}
+
+    async def attach_db(self, db):
+        if db is None:
+            return
+        try:
+            await db.listing_details.create_index("fetched_at", expireAfterSeconds=ENRICH_CACHE_DAYS * 86400)
+            self.db = db
+        except Exception as e:
+            print(f"[ENRICH mongo disabled] {e}")
+
+    async def enrich(self, items: Sequence[Listing], limit: int = ENRICH_MAX_ITEMS) -> List[Listing]:
+        """Первые `limit` объявлений с полями со страницы объявления; порядок и остальные — как были."""
+        ids = list(dict.fromkeys(x["marketplace_id"] for x in items[:limit] if x["marketplace_id"]))
+        if not ids:
+            return list(items)
+        with span("enrich"):
+            details = self._get_local(ids)
+            missing = [mid for mid in ids if mid not in details]
+            if missing:
+                details.update(await self._get_mongo(missing))
+                missing = [mid for mid in missing if mid not in details]
+            if missing:
+                try:
+                    details.update(await self._load(missing))
+                except Exception as e:
+                    # нет свободной сессии / пул браузеров занят: обогащение необязательно, выдача остаётся как есть
+                    self._counters["unavailable"] += 1
+                    errors_total.inc(where="enrich")
+                    print(f"[ENRICH skipped] {e}")
+        return [self._apply(x, details.get(x["marketplace_id"])) for x in items]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "entries": len(self._cache), "inflight": len(self._inflight),
+                "tabs": self.tabs, "rate": self.bucket.rate}
+
+    # ------------------------------------------------------------------ internals
+    @staticmethod
+    def _apply(item: Listing, detail: Optional[Dict[str, str]]) -> Listing:
+        if not detail:
+            return item
+        return Listing(item["marketplace_id"], item["title"], item["price"], detail.get("city") or item["city"],
+                       item["category"], item["image_url"], item["url"],
+                       detail.get("published_at") or item["published_at"],
+                       detail.get("condition") or item["condition"], detail.get("description", ""))
+
+    def _get_local(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
+        found = {}
+        for mid in ids:
+            detail = self._cache.get(mid)
+            if detail is not None:
+                self._cache.move_to_end(mid)
+                self._counters["hits"] += 1
+                found[mid] = detail
+        return found
+
+    def _put_local(self, mid: str, detail: Dict[str, str]):
+        self._cache[mid] = detail
+        self._cache.move_to_end(mid)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _get_mongo(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
+        if self.db is None:
+            return {}
+        try:
+            with span("mongo_details_get"):
+                docs = [d async for d in self.db.listing_details.find({"_id": {"$in": ids}})]
+        except Exception as e:
+            errors_total.inc(where="enrich_mongo")
+            print(f"[ENRICH mongo get error] {e}")
+            return {}
+        found = {}
+        for doc in docs:
+            mid = doc.pop("_id")
+            doc.pop("fetched_at", None)
+            self._put_local(mid, doc)
+            found[mid] = doc
+        self._counters["mongo_hits"] += len(found)
+        return found
+
+    async def _put_mongo(self, details: Dict[str, Dict[str, str]]):
+        if self.db is None or not details:
+            return
+        now = datetime.utcnow()
+        try:
+            with span("mongo_details_put"):
+                await self.db.listing_details.bulk_write(
+                    [UpdateOne({"_id": mid}, {"$set": {**detail, "fetched_at": now}}, upsert=True)
+                     for mid, detail in details.items()],
+                    ordered=False,
+                )
+        except Exception as e:
+            errors_total.inc(where="enrich_mongo")
+            print(f"[ENRICH mongo put error] {e}")
+
+    async def _load(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Свои id грузим, уже загружаемые другим запросом — ждём (single-flight)."""
+        loop = asyncio.get_running_loop()
+        own = [mid for mid in ids if mid not in self._inflight]
+        waiting = {mid: self._inflight[mid] for mid in ids if mid in self._inflight}
+        for mid in own:
+            self._inflight[mid] = loop.create_future()
+        fetched: Dict[str, Dict[str, str]] = {}
+        try:
+            if own:
+                fetched = await self._fetch_all(own)
+                for mid, detail in fetched.items():
+                    self._put_local(mid, detail)
+                await self._put_mongo(fetched)
+        finally:
+            for mid in own:
+                fut = self._inflight.pop(mid)
+                if not fut.done():
+                    fut.set_result(fetched.get(mid))
+        for mid, fut in waiting.items():
+            detail = await asyncio.shield(fut)
+            if detail:
+                fetched[mid] = detail
+        return fetched
+
+    async def _throttle(self):
+        while not self.bucket.try_acquire():
+            await asyncio.sleep(self.bucket.wait_time())
+
+    async def _fetch_all(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
+        queue = deque(ids)
+        results: Dict[str, Dict[str, str]] = {}
+        blocked = False
+        acct = await session_pool.acquire()
+
+        async def tab(context):
+            nonlocal blocked
+            page = await context.new_page()
+            track_page(page)
+            try:
+                while queue and not blocked:
+                    mid = queue.popleft()
+                    await self._throttle()
+                    try:
+                        results[mid] = await self._fetch_one(page, mid)
+                        self._counters["fetched"] += 1
+                    except SessionBlocked:
+                        blocked = True
+                    except Exception as e:
+                        self._counters["failed"] += 1
+                        errors_total.inc(where="enrich")
+                        print(f"[ENRICH ERROR] {mid}: {e}")
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+
+        async with browser_pool().context(acct.name if acct else None) as context:
+            await asyncio.gather(*(tab(context) for _ in range(min(self.tabs, len(ids)))))
+        if acct is not None:
+            if blocked:
+                self._counters["blocked"] += 1
+                session_pool.report_blocked(acct)
+            else:
+                session_pool.report_ok(acct)
+        return results
+
+    async def _fetch_one(self, page, mid: str) -> Dict[str, str]:
+        with span("detail"):
+            await page.goto(ITEM_URL.format(id=mid), wait_until="domcontentloaded", timeout=PAGE_TIMEOUT_MS)
+        if is_blocked(page.url):
+            raise SessionBlocked(page.url)
+        text, og_description, creation_time = await page.evaluate(_DETAIL_JS)
+        return parse_detail(text, og_description, creation_time)
+
+
+detail_enricher = DetailEnricher()
@@ -0,0 +1,135 @@
+import heapq
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import quote_plus, urlencode
+
+from app.marketplace.geo import distance_miles, geocode
+
+# Значения UI -> параметры URL marketplace
+SORT_PARAMS = {"date_desc": "creation_time_descend", "price_asc": "price_ascend", "price_desc": "price_descend"}
+CONDITION_PARAMS = {"new": "new", "like new": "used_like_new", "good": "used_good", "fair": "used_fair"}
+DATE_RANGE_DAYS = {"last_24h": 1, "last_3d": 3, "last_7d": 7}
+MILES_TO_KM = 1.609344
+
+Predicate = Callable[[Dict[str, Any]], bool]
+_NUMERIC = ("price_min", "price_max", "radius")
+
+
+def _number(value: Any) -> Optional[float]:
+    """"" / "abc" / None -> None: форма UI шлёт пустые поля строками."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Копия фильтров с числовыми price_min/price_max/radius (или None); сохранённые поиски приходят как есть из UI."""
+    out = dict(filters or {})
+    for name in _NUMERIC:
+        out[name] = _number(out.get(name))
+    return out
+
+
+def build_search_url(template: str, query: Optional[str], filters: Dict[str, Any]) -> str:
+    """
+    Переносит фильтры в query string поиска, чтобы marketplace сам отрезал лишнее
+    и скрапить приходилось меньше. Post-фильтр (compile_predicate) всё равно применяется.
+    """
+    filters = normalize_filters(filters)
+    url = template.format(q=quote_plus((query or "").strip()))
+    params: Dict[str, Any] = {}
+    if filters.get("price_min") is not None:
+        params["minPrice"] = int(filters["price_min"])
+    if filters.get("price_max") is not None:
+        params["maxPrice"] = int(filters["price_max"])
+    days = DATE_RANGE_DAYS.get(filters.get("date_range") or "any")
+    if days:
+        params["daysSinceListed"] = days
+    condition = CONDITION_PARAMS.get(str(filters.get("condition") or "").lower())
+    if condition:
+        params["itemCondition"] = condition
+    sort = SORT_PARAMS.get(filters.get("sort_by") or "")
+    if sort:
+        params["sortBy"] = sort
+    center = geocode(filters.get("location") or "")
+    if center is not None:
+        # центр поиска — город из фильтра, а не местоположение аккаунта; иначе post-фильтр по радиусу
+        # отрезал бы всю выдачу. Город не в справочнике — радиус не передаём, выдача как без фильтра
+        params["latitude"], params["longitude"] = round(center[0], 4), round(center[1], 4)
+        if filters.get("radius"):
+            params["radius"] = round(filters["radius"] * MILES_TO_KM)
+    if not params:
+        return url
+    return url + ("&" if "?" in url else "?") + urlencode(params)
+
+
+def _timestamp(value: Any) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def compile_predicate(filters: Dict[str, Any]) -> Predicate:
+    """Собирает проверки один раз на запрос; на каждое объявление — только сравнения."""
+    filters = normalize_filters(filters)
+    checks: List[Predicate] = []
+
+    lo, hi = filters.get("price_min"), filters.get("price_max")
+    if lo is not None:
+        checks.append(lambda x: x["price"] >= lo)
+    if hi is not None:
+        checks.append(lambda x: x["price"] <= hi)
+
+    condition = filters.get("condition")
+    if condition and condition != "Any":
+        wanted = condition.lower()
+        # состояние из карточки неизвестно ("Any") — не отсекаем, уточнит enrichment
+        checks.append(lambda x: (x.get("condition") or "Any") == "Any" or x["condition"].lower() == wanted)
+
+    days = DATE_RANGE_DAYS.get(filters.get("date_range") or "any")
+    if days:
+        cutoff = (datetime.utcnow() - timedelta(days=days)).timestamp()
+        checks.append(lambda x: _timestamp(x.get("published_at")) >= cutoff)
+
+    center = geocode(filters.get("location") or "")
+    if center is not None and filters.get("radius"):
+        radius = filters["radius"]
+        # город карточки не распознан ("—", нет в справочнике) — не отсекаем
+        checks.append(lambda x: (p := geocode(x.get("city") or "")) is None or distance_miles(center, p) <= radius)
+
+    if not checks:
+        return lambda x: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda x: all(c(x) for c in checks)
+
+
+_SORT_KEYS = {
+    "date_desc": (lambda x: _timestamp(x.get("published_at")), True),
+    "price_asc": (lambda x: x["price"], False),
+    "price_desc": (lambda x: x["price"], True),
+}
+
+
+def sort_listings(items: List[Dict[str, Any]], sort_by: Optional[str],
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Полная сортировка или top-k через heapq, если нужна только страница (limit < len)."""
+    key, reverse = _SORT_KEYS.get(sort_by or "date_desc", _SORT_KEYS["date_desc"])
+    if limit is not None and 0 < limit < len(items):
+        pick = heapq.nlargest if reverse else heapq.nsmallest
+        return pick(limit, items, key=key)
+    return sorted(items, key=key, reverse=reverse)
+
+
+def apply_filters(items: List[Dict[str, Any]], filters: Dict[str, Any],
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    pred = compile_predicate(filters)
+    return sort_listings([x for x in items if pred(x)], filters.get("sort_by"), limit)
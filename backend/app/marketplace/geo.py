@@ -0,0 +1,78 @@
+import csv
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+GAZETTEER_PATH = os.getenv(
+    "GEO_GAZETTEER", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "gazetteer.csv")
+)
+EARTH_RADIUS_MILES = 3958.8
+
+Point = Tuple[float, float]  # (lat, lon)
+
+STATES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca", "colorado": "co",
+    "connecticut": "ct", "delaware": "de", "district of columbia": "dc", "florida": "fl", "georgia": "ga",
+    "hawaii": "hi", "idaho": "id", "illinois": "il", "indiana": "in", "iowa": "ia", "kansas": "ks",
+    "kentucky": "ky", "louisiana": "la", "maine": "me", "maryland": "md", "massachusetts": "ma",
+    "michigan": "mi", "minnesota": "mn", "mississippi": "ms", "missouri": "mo", "montana": "mt",
+    "nebraska": "ne", "nevada": "nv", "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm",
+    "new york": "ny", "north carolina": "nc", "north dakota": "nd", "ohio": "oh", "oklahoma": "ok",
+    "oregon": "or", "pennsylvania": "pa", "rhode island": "ri", "south carolina": "sc", "south dakota": "sd",
+    "tennessee": "tn", "texas": "tx", "utah": "ut", "vermont": "vt", "virginia": "va", "washington": "wa",
+    "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy",
+}
+
+_SPACES_RE = re.compile(r"\s+")
+_places: Optional[Dict[str, Point]] = None
+
+
+def _norm_city(city: str) -> str:
+    city = _SPACES_RE.sub(" ", city.lower().replace(".", "").strip())
+    return re.sub(r"^(st|ste) ", "saint ", city)
+
+
+def _load() -> Dict[str, Point]:
+    """Справочник городов (CSV рядом с кодом): ключи «city, st» и просто «city» — самый крупный из тёзок."""
+    global _places
+    if _places is None:
+        places: Dict[str, Point] = {}
+        with open(GAZETTEER_PATH, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):  # файл отсортирован по населению
+                city, point = _norm_city(row["city"]), (float(row["lat"]), float(row["lon"]))
+                places.setdefault(f"{city}, {row['state'].lower()}", point)
+                places.setdefault(city, point)
+        _places = places
+    return _places
+
+
+@lru_cache(maxsize=8192)
+def geocode(place: str) -> Optional[Point]:
+    """«Austin, TX» / «Austin, Texas» / «austin» -> (lat, lon); None, если города нет в справочнике."""
+    if not place:
+        return None
+    city, _, state = place.partition(",")
+    city = _norm_city(city)
+    state = state.strip().lower().replace(".", "")
+    state = STATES.get(state, state)[:2] if state else ""
+    places = _load()
+    return places.get(f"{city}, {state}") if state else places.get(city)
+
+
+def distance_miles(a: Point, b: Point) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+
+def geo_point(place: str) -> Optional[Dict[str, object]]:
+    """GeoJSON Point для 2dsphere-индекса Mongo (порядок координат — lon, lat)."""
+    point = geocode(place)
+    return {"type": "Point", "coordinates": [point[1], point[0]]} if point else None
+
+
+def within_radius(center: Point, radius_miles: float) -> Dict[str, object]:
+    """Условие $geoWithin/$centerSphere по полю geo: идёт по 2dsphere-индексу, без перебора коллекции."""
+    return {"$geoWithin": {"$centerSphere": [[center[1], center[0]], radius_miles / EARTH_RADIUS_MILES]}}
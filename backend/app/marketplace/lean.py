@@ -0,0 +1,98 @@
+import asyncio
+import os
+from typing import Any, Dict, Iterable, Set
+from urllib.parse import urlsplit
+
+LEAN_MODE = os.getenv("SCAN_LEAN", "1") not in ("0", "false", "False", "")
+# Картинки не нужны: читаем только атрибут src. Стили не режем — от них зависит innerText.
+LEAN_BLOCK_TYPES = {t.strip() for t in os.getenv("SCAN_BLOCK_TYPES", "image,media,font").split(",") if t.strip()}
+LEAN_EXTRA_HOSTS = [h.strip() for h in os.getenv("SCAN_ALLOWED_HOSTS", "").split(",") if h.strip()]
+LEAN_DISABLE_JS = os.getenv("SCAN_DISABLE_JS", "0") in ("1", "true", "True")
+FIRST_PARTY_HOSTS = ["facebook.com", "fbcdn.net", "fbsbx.com"]
+
+
+class LeanStats:
+    """Суммарные счётчики по всем страницам скрапера: сколько грузили и сколько отрезали."""
+
+    def __init__(self):
+        self.pages = 0
+        self.load_ms = 0.0
+        self.loads = 0          # страниц с замеренным load_ms (выдача); страницы объявлений его не пишут
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        pages = self.pages or 1
+        return {
+            "lean": LEAN_MODE,
+            "pages": self.pages,
+            "requests": self.requests,
+            "blocked": self.blocked,
+            "bytes": self.bytes,
+            "bytes_per_page": int(self.bytes / pages),
+            "load_ms_avg": round(self.load_ms / self.loads, 1) if self.loads else 0.0,
+        }
+
+    def record_load(self, ms: float):
+        self.load_ms += ms
+        self.loads += 1
+
+
+lean_stats = LeanStats()
+
+
+class LeanPolicy:
+    def __init__(self, allowed_hosts: Iterable[str], block_types: Set[str] = LEAN_BLOCK_TYPES):
+        self.allowed_hosts = [h.lower().lstrip(".") for h in allowed_hosts if h]
+        self.block_types = block_types
+
+    def context_options(self) -> Dict[str, Any]:
+        opts: Dict[str, Any] = {"service_workers": "block"}
+        if LEAN_DISABLE_JS:
+            opts["java_script_enabled"] = False
+        return opts
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.block_types:
+            return True
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return False
+        host = (parts.hostname or "").lower()
+        return not any(host == h or host.endswith("." + h) for h in self.allowed_hosts)
+
+    async def setup_context(self, context):
+        if LEAN_MODE:
+            await context.route("**/*", self._route)
+
+    async def _route(self, route):
+        req = route.request
+        if self.should_block(req.resource_type, req.url):
+            lean_stats.blocked += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+
+def policy_for(base_url: str) -> LeanPolicy:
+    """Первая сторона = facebook + хост FB_BASE (чтобы работали и локальные фикстуры)."""
+    return LeanPolicy(FIRST_PARTY_HOSTS + [urlsplit(base_url).hostname or ""] + LEAN_EXTRA_HOSTS)
+
+
+def track_page(page):
+    """Считает запросы и реально переданные байты страницы (через request.sizes())."""
+    lean_stats.pages += 1
+
+    async def _count(request):
+        try:
+            sizes = await request.sizes()
+            lean_stats.bytes += sizes.get("responseBodySize", 0) + sizes.get("responseHeadersSize", 0)
+        except Exception:
+            pass
+
+    def _on_finished(request):
+        lean_stats.requests += 1
+        asyncio.ensure_future(_count(request))
+
+    page.on("requestfinished", _on_finished)
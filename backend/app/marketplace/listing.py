@@ -0,0 +1,54 @@
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+LISTING_FIELDS = (
+    "marketplace_id", "title", "price", "city", "category",
+    "image_url", "url", "published_at", "condition", "description",
+)
+_FIELD_SET = frozenset(LISTING_FIELDS)
+
+
+class Listing(Mapping):
+    """
+    Объявление из выдачи. __slots__ вместо dict: объект в несколько раз меньше,
+    а читается как словарь (x["price"], x.get(...), {**x}) — сканер, кэш, хранилище,
+    фильтры и уведомления работают с ним без изменений. В Mongo/JSON — через to_dict().
+    """
+
+    __slots__ = LISTING_FIELDS
+
+    def __init__(self, marketplace_id: str = "", title: str = "", price: float = 0.0, city: str = "—",
+                 category: str = "Miscellaneous", image_url: str = "", url: str = "",
+                 published_at: str = "", condition: str = "Any", description: str = ""):
+        self.marketplace_id = marketplace_id
+        self.title = title
+        self.price = price
+        self.city = city
+        self.category = category
+        self.image_url = image_url
+        self.url = url
+        self.published_at = published_at
+        self.condition = condition
+        self.description = description  # только после enrichment (страница объявления)
+
+    @classmethod
+    def from_doc(cls, doc: Mapping) -> "Listing":
+        """Из словаря (Mongo, кэш); лишние поля отбрасываются, отсутствующие — по умолчанию."""
+        return cls(**{k: doc[k] for k in LISTING_FIELDS if k in doc})
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(LISTING_FIELDS)
+
+    def __len__(self) -> int:
+        return len(LISTING_FIELDS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in LISTING_FIELDS}
+
+    def __repr__(self) -> str:
+        return f"Listing({self.marketplace_id!r}, {self.title!r}, {self.price!r})"
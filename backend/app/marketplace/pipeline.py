@@ -0,0 +1,85 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.metrics import errors_total
+from app.core.timing import span
+from app.marketplace.cache import search_cache
+from app.marketplace.dedup import dedup_index
+from app.marketplace.enrich import detail_enricher
+from app.marketplace.filters import compile_predicate
+from app.marketplace.prices import price_tracker
+from app.marketplace.velocity import observe_yield
+from app.marketplace.scanner import search_marketplace
+from app.notifications.dispatcher import dispatcher
+from app.storage.listings import upsert_listings
+from app.storage.seen import mark_seen
+
+# Общий конвейер скрапинга: им пользуются и API (server.py), и отдельный воркер (worker.py).
+
+
+async def store_listings(db, items: List[Dict[str, Any]]):
+    if db is None or not items:
+        return
+    try:
+        await price_tracker.observe(items)
+    except Exception as e:
+        errors_total.inc(where="prices")
+        print(f"[prices error] {e}")
+    try:
+        with span("mongo_listings_upsert"):
+            await upsert_listings(db, items)
+    except Exception as e:
+        errors_total.inc(where="listings_store")
+        print(f"[listings store error] {e}")
+
+
+async def scrape_and_store(db, query: str, filters: Dict[str, Any], timeout: Optional[float] = None):
+    """
+    Скрапинг на промахе кэша. В listings уходит вся выдача, а возвращается схлопнутая:
+    подтверждённые по превью дубли (перевыложенное с новым id) — одним объявлением.
+    """
+    items = await search_marketplace(query, filters, timeout=timeout)
+    await store_listings(db, items)
+    return await dedup_index.collapse(items)
+
+
+async def enrich_and_store(db, items: List[Dict[str, Any]], filters: Dict[str, Any]):
+    """
+    Данные со страниц объявлений поверх карточек выдачи. Фильтры применяются повторно:
+    теперь известны настоящие дата публикации, состояние и город.
+    """
+    items = await detail_enricher.enrich(items)
+    await store_listings(db, items)
+    pred = compile_predicate(filters)
+    return [x for x in items if pred(x)]
+
+
+async def scan_group(db, searches: List[Dict[str, Any]]):
+    """Один скрапинг на группу сохранённых поисков с одинаковыми query+filters."""
+    query, filters = searches[0].get("query", ""), searches[0].get("filters", {})
+    # кэш не читаем: скан внутри SEARCH_CACHE_TTL получил бы старую выдачу и занизил скорость поиска
+    items = await search_cache.get_or_fetch(query, filters, lambda: scrape_and_store(db, query, filters), fresh=True)
+    for ss in searches:
+        with span("mongo_seen"):
+            new_items = await mark_seen(db, str(ss["_id"]), items)
+        last_scan_at = ss.get("last_scan_at")
+        first_scan = last_scan_at is None
+        mode = ss.get("alert_mode") or "new"
+        if items:
+            now = datetime.utcnow()
+            fields: Dict[str, Any] = {"last_scan_at": now}
+            if not first_scan:
+                # скорость поиска для адаптивного интервала; первый скан — вся выдача, не в счёт
+                fields.update(observe_yield(ss, len(new_items), now))
+            await db.saved_searches.update_one({"_id": ss["_id"]}, {"$set": fields})
+        if first_scan:
+            continue   # первый скан только заполняет seen-индекс, иначе пришли бы уведомления обо всей выдаче
+        recipient = os.getenv("SMTP_USER") or "you@example.com"
+        if mode != "price_drop":
+            # та же вещь из другого поиска или перевыложенная с новым id — без повторного уведомления;
+            # клеймим только то, о чём действительно уведомляем, иначе тихий первый скан глушит другие поиски
+            dispatcher.notify_listings(recipient, query, await dedup_index.claim_notifications(new_items))
+        if mode != "new":
+            # подешевели с прошлого скана этого поиска (история пишется в store_listings)
+            dispatcher.notify_price_drops(recipient, query, price_tracker.drops(items, since=last_scan_at))
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from playwright.async_api import async_playwright
+
+from app.core.timing import span
+
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+POOL_MAX_PAGES = int(os.getenv("BROWSER_POOL_MAX_PAGES", "50"))      # recycle после K страниц
+POOL_QUEUE_LIMIT = int(os.getenv("BROWSER_POOL_QUEUE", "16"))        # сколько задач может ждать
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("BROWSER_POOL_TIMEOUT", "60"))
+
+LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-setuid-sandbox",
+]
+
+
+class PoolBusy(RuntimeError):
+    """Очередь пула переполнена или ожидание слота превысило таймаут."""
+
+
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.browser = None
+        self.contexts: Dict[str, Any] = {}        # аккаунт -> BrowserContext
+        self.generations: Dict[str, tuple] = {}
+        self.pages_served = 0
+
+    def healthy(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    async def close(self):
+        for obj in [*self.contexts.values(), self.browser]:
+            try:
+                if obj is not None:
+                    await obj.close()
+            except Exception:
+                pass
+        self.browser = None
+        self.contexts, self.generations = {}, {}
+        self.pages_served = 0
+
+
+class BrowserPool:
+    """
+    N заранее запущенных headless Chromium на одном драйвере async Playwright.
+    Слот выдаётся через `async with pool.context() as ctx`; ждать слота
+    могут не больше queue_limit задач, остальные сразу получают PoolBusy.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_pages: int = POOL_MAX_PAGES,
+                 queue_limit: int = POOL_QUEUE_LIMIT, checkout_timeout: float = POOL_CHECKOUT_TIMEOUT,
+                 storage_state: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+                 context_options: Optional[Dict[str, Any]] = None,
+                 setup_context: Optional[Callable[[Any], Awaitable[None]]] = None):
+        self.size = max(1, size)
+        self.max_pages = max(1, max_pages)
+        self.queue_limit = max(0, queue_limit)
+        self.checkout_timeout = checkout_timeout
+        self.storage_state = storage_state   # storage_state из памяти (SessionManager), без файла
+        self.context_options = context_options or {}
+        self.setup_context = setup_context   # например, перехват запросов (lean-режим)
+        self._playwright = None
+        self._slots = [_Slot(i) for i in range(self.size)]
+        self._idle: Optional[asyncio.Queue] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._generation = 0
+        self._account_generations: Dict[str, int] = {}
+        self._waiting = 0
+        self._waits = deque(maxlen=200)
+        self._counters = {"jobs": 0, "rejected": 0, "launches": 0, "recycles": 0, "crashes": 0}
+
+    # ------------------------------------------------------------------ lifecycle
+    async def start(self):
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._idle is not None:
+                return
+            self._playwright = await async_playwright().start()
+            results = await asyncio.gather(*(self._ensure_browser(s) for s in self._slots), return_exceptions=True)
+            for slot, res in zip(self._slots, results):
+                if isinstance(res, Exception):
+                    print(f"[POOL] browser-{slot.index} warmup failed: {res}")
+            self._idle = asyncio.Queue()
+            for slot in self._slots:
+                self._idle.put_nowait(slot)
+
+    async def close(self):
+        if self._idle is None:
+            return
+        await asyncio.gather(*(s.close() for s in self._slots), return_exceptions=True)
+        try:
+            await self._playwright.stop()
+        except Exception:
+            pass
+        self._playwright = None
+        self._idle = None
+
+    def invalidate_contexts(self, account: Optional[str] = None):
+        """Сессия аккаунта (или всех) изменилась — его контексты пересоздадутся при следующей выдаче."""
+        if account is None:
+            self._generation += 1
+        else:
+            self._account_generations[account] = self._account_generations.get(account, 0) + 1
+
+    # ------------------------------------------------------------------ public API
+    @asynccontextmanager
+    async def context(self, account: Optional[str] = None):
+        """
+        Выдаёт прогретый BrowserContext с cookies аккаунта (None — без логина);
+        при отмене/ошибке слот всё равно возвращается в пул.
+        """
+        if self._idle is None:
+            await self.start()
+        if self._idle.empty() and self._waiting >= self.queue_limit:
+            self._counters["rejected"] += 1
+            raise PoolBusy("browser pool queue is full")
+
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            slot = await asyncio.wait_for(self._idle.get(), timeout=self.checkout_timeout)
+        except asyncio.TimeoutError:
+            self._counters["rejected"] += 1
+            raise PoolBusy("timed out waiting for a browser")
+        finally:
+            self._waiting -= 1
+        self._waits.append(time.monotonic() - started)
+
+        try:
+            await self._ensure_browser(slot)
+            yield await self._ensure_context(slot, account or "")
+        finally:
+            slot.pages_served += 1
+            self._counters["jobs"] += 1
+            if not slot.healthy():
+                self._counters["crashes"] += 1
+                await slot.close()
+            self._idle.put_nowait(slot)
+
+    def saturated(self) -> bool:
+        """Свободных браузеров нет и очередь заполнена хотя бы наполовину — фоновым задачам лучше подождать."""
+        if self._idle is None or not self._idle.empty():
+            return False
+        return self._waiting >= max(1, self.queue_limit // 2)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        idle = self._idle.qsize() if self._idle is not None else self.size
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        return {
+            "size": self.size,
+            "busy": self.size - idle,
+            "idle": idle,
+            "alive": sum(1 for s in self._slots if s.browser is not None),
+            "queued": self._waiting,
+            "queue_limit": self.queue_limit,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+            **self._counters,
+        }
+
+    # ------------------------------------------------------------------ internals
+    async def _ensure_browser(self, slot: _Slot):
+        if slot.healthy() and slot.pages_served < self.max_pages:
+            return
+        if slot.browser is not None:
+            self._counters["recycles" if slot.browser.is_connected() else "crashes"] += 1
+        await slot.close()
+        with span("launch"):
+            slot.browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self._counters["launches"] += 1
+
+    async def _ensure_context(self, slot: _Slot, account: str):
+        generation = (self._generation, self._account_generations.get(account, 0))
+        context = slot.contexts.get(account)
+        if context is not None and slot.generations.get(account) == generation:
+            return context
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+        opts = dict(self.context_options)
+        state = self.storage_state(account) if (self.storage_state is not None and account) else None
+        if state:
+            opts["storage_state"] = state
+        with span("context"):
+            context = await slot.browser.new_context(**opts)
+            if self.setup_context is not None:
+                await self.setup_context(context)
+        slot.contexts[account], slot.generations[account] = context, generation
+        return context
+
+
+_pool: Optional[BrowserPool] = None
+
+
+def get_pool(**kwargs) -> BrowserPool:
+    """Общий пул процесса; kwargs учитываются только при первом вызове."""
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool(**kwargs)
+    return _pool
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.metrics import errors_total
+from app.core.timing import span
+
+PRICE_WARM_DAYS = int(os.getenv("PRICE_WARM_DAYS", "90"))           # какие бакеты читать на старте
+PRICE_DROP_MIN_PCT = float(os.getenv("PRICE_DROP_MIN_PCT", "5"))     # меньшее снижение — не повод для алерта
+PRICE_DROP_KEEP_HOURS = float(os.getenv("PRICE_DROP_KEEP_HOURS", "48"))
+PRICE_BUCKET_POINTS = 500                                            # защита от раздувания документа
+
+
+def _bucket(at: datetime) -> Tuple[str, datetime]:
+    start = at.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start.strftime("%Y-%m"), start
+
+
+class PriceTracker:
+    """
+    История цен по marketplace_id. Хранение — бакеты price_history по (объявление, месяц):
+    точки [секунд от начала месяца, цена] пишутся только при изменении цены, так что
+    объявление с неизменной ценой занимает одну точку, сколько бы сканов ни было.
+    Последняя известная цена — в памяти (прогревается из Mongo на старте): сравнение
+    каждого объявления скана — O(1) по словарю, в Mongo уходят только изменения.
+    Снижение засчитывает только процесс, чья запись в бакет прошла (прежняя цена — из Mongo),
+    и пишет его в бакет: остальные API/воркеры берут его оттуда, а не находят заново.
+    """
+
+    def __init__(self, drop_min_pct: float = PRICE_DROP_MIN_PCT, keep_hours: float = PRICE_DROP_KEEP_HOURS):
+        self.drop_min_pct = drop_min_pct
+        self.keep_seconds = keep_hours * 3600
+        self.db = None
+        self._last: Dict[str, float] = {}
+        self._drops: Dict[str, Tuple[float, float, float]] = {}   # mid -> (прежняя цена, новая, когда)
+        self._counters = {"observed": 0, "changes": 0, "drops": 0, "errors": 0}
+
+    async def attach_db(self, db, warm: bool = True):
+        """
+        Индекс и прогрев последних цен; вызывается на старте, если Mongo настроен.
+        warm=False — прогрев отдельно (API: история цен доступна, не дожидаясь его).
+        """
+        if db is None:
+            return
+        try:
+            await db.price_history.create_index([("marketplace_id", 1), ("month", 1)])
+            self.db = db
+            if warm:
+                await self.warm()
+        except Exception as e:
+            print(f"[PRICES mongo disabled] {e}")
+
+    async def warm(self):
+        if self.db is None:
+            return
+        month, _ = _bucket(datetime.utcnow() - timedelta(days=PRICE_WARM_DAYS))
+        try:
+            with span("mongo_prices_warm"):
+                cur = self.db.price_history.find({"month": {"$gte": month}},
+                                                 {"_id": 0, "marketplace_id": 1, "last_price": 1}).sort("month", 1)
+                async for doc in cur:
+                    self._last[doc["marketplace_id"]] = doc["last_price"]   # более поздний месяц перезаписывает
+        except Exception as e:
+            print(f"[PRICES warm error] {e}")
+
+    async def observe(self, items: Sequence[Dict[str, Any]]):
+        """Сверяет цены скана с последними известными; изменения пишет в историю, снижения запоминает."""
+        now = datetime.utcnow()
+        ts = time.time()
+        month, start = _bucket(now)
+        offset = int((now - start).total_seconds())
+        changes: List[Tuple[str, float, Optional[float]]] = []
+        for item in items:
+            mid, price = item.get("marketplace_id"), item.get("price") or 0.0
+            if not mid or price <= 0:   # "Free"/не распознана — не цена
+                continue
+            self._counters["observed"] += 1
+            old = self._last.get(mid)
+            if old == price:
+                continue
+            self._last[mid] = price
+            changes.append((mid, price, old))
+        self._counters["changes"] += len(changes)
+        if changes and self.db is not None:
+            with span("mongo_prices_append"):
+                await asyncio.gather(*(self._append(month, start, offset, ts, *change) for change in changes))
+        else:
+            for mid, price, old in changes:
+                self._record_drop(mid, old, price, ts)
+        if len(self._drops) > 1000:
+            self._drops = {k: d for k, d in self._drops.items() if ts - d[2] < self.keep_seconds}
+
+    def drops(self, items: Sequence[Dict[str, Any]], since: Optional[datetime] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """(объявление, прежняя цена) для объявлений выдачи, подешевевших после `since`."""
+        cutoff = time.time() - self.keep_seconds
+        if since is not None:   # last_scan_at — naive UTC
+            cutoff = max(cutoff, since.replace(tzinfo=timezone.utc).timestamp())
+        out = []
+        for item in items:
+            drop = self._drops.get(item.get("marketplace_id") or "")
+            if drop is not None and drop[2] >= cutoff and drop[1] == item.get("price"):
+                out.append((item, drop[0]))
+        return out
+
+    async def history(self, marketplace_id: str) -> List[Dict[str, Any]]:
+        """[{"at": ISO, "price": ...}] по возрастанию времени; бакеты читаются по индексу."""
+        if self.db is None:
+            return []
+        points = []
+        with span("mongo_prices_history"):
+            cur = self.db.price_history.find({"marketplace_id": marketplace_id},
+                                             {"_id": 0, "start": 1, "points": 1}).sort("month", 1)
+            async for doc in cur:
+                for offset, price in doc["points"]:
+                    points.append({"at": (doc["start"] + timedelta(seconds=offset)).isoformat(), "price": price})
+        return points
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._counters, "tracked": len(self._last), "recent_drops": len(self._drops)}
+
+    # ------------------------------------------------------------------ internals
+    def _record_drop(self, mid: str, before: Optional[float], price: float, ts: float) -> Optional[Tuple[float, float, float]]:
+        if before is None or price > before * (1 - self.drop_min_pct / 100):
+            return None
+        drop = (before, price, ts)
+        self._drops[mid] = drop
+        self._counters["drops"] += 1
+        return drop
+
+    async def _append(self, month: str, start: datetime, offset: int, ts: float,
+                      mid: str, price: float, old: Optional[float]):
+        bucket_id = f"{mid}:{month}"
+        try:
+            try:
+                prev = await self.db.price_history.find_one_and_update(
+                    # та же цена уже записана другим процессом — точку не дублируем
+                    {"_id": bucket_id, "last_price": {"$ne": price}, "n": {"$lt": PRICE_BUCKET_POINTS}},
+                    {
+                        "$push": {"points": [offset, price]},
+                        "$set": {"last_price": price},
+                        "$inc": {"n": 1},
+                        "$setOnInsert": {"marketplace_id": mid, "month": month, "start": start},
+                    },
+                    projection={"last_price": 1},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # фильтр не совпал у существующего бакета: цену записал другой процесс (или бакет полон) —
+                # снижение, если было, он и засчитал; берём его запись с его временем
+                doc = await self.db.price_history.find_one({"_id": bucket_id}, {"drop": 1})
+                drop = (doc or {}).get("drop")
+                if drop and drop[1] == price:
+                    self._drops[mid] = tuple(drop)
+                return
+            # новый бакет (начало месяца) вставляет ровно один процесс — ему и сравнивать с памятью
+            drop = self._record_drop(mid, prev["last_price"] if prev else old, price, ts)
+            if drop is not None:
+                await self.db.price_history.update_one({"_id": bucket_id}, {"$set": {"drop": list(drop)}})
+        except Exception as e:
+            self._counters["errors"] += 1
+            errors_total.inc(where="prices_mongo")
+            print(f"[PRICES append error] {e}")
+
+
+price_tracker = PriceTracker()
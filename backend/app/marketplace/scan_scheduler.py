@@ -0,0 +1,249 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from app.core.metrics import errors_total
+from app.marketplace.cache import canonical_key
+from app.marketplace.velocity import (SCAN_BUDGET_PER_HOUR, SCAN_INTERVAL_MINUTES, allocate, desired_interval,
+                                      predicted_yield)
+from app.storage.jobs import ScanJobQueue, acquire_lease, worker_id
+
+SCAN_TICK_SECONDS = int(os.getenv("SCAN_TICK_SECONDS", "30"))            # как часто проверяем, кому пора
+SCAN_JITTER = float(os.getenv("SCAN_JITTER", "0.2"))                    # ±20% к интервалу
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "2"))
+SCAN_POLL_SECONDS = float(os.getenv("SCAN_POLL_SECONDS", "2"))          # пауза воркера при пустой очереди
+PRODUCER_LEASE = "scan_producer"
+PLAN_REFRESH_SECONDS = 300   # как часто пересчитывать раскладку бюджета по всем поискам
+
+
+class ScanScheduler:
+    """
+    Сканы сохранённых поисков через очередь в Mongo (app.storage.jobs):
+      - producer (`tick`): только лидер (lease в коллекции leases) находит поиски с
+        next_run_at <= now, группирует одинаковые query+filters в одну задачу и ставит
+        её в очередь; next_run_at сдвигается на интервал поиска (с джиттером);
+      - интервал адаптивный (app.marketplace.velocity): по EWMA новых объявлений в час,
+        между SCAN_MIN_MINUTES и SCAN_MAX_MINUTES, а сумма сканов в час по всем группам
+        укладывается в budget_per_hour с долями по приоритету;
+      - worker (`run_worker`): забирает задачи атомарно, держит не больше `concurrency`
+        параллельно, продлевает lease, пока идёт скан; не берёт новые, если скрапер
+        перегружен (`saturated()`).
+    Оба можно запускать в любом числе процессов (API и/или worker.py) — задача по
+    одному ключу активна максимум одна, и выполняет её один воркер.
+    """
+
+    def __init__(self, run_group: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+                 saturated: Optional[Callable[[], bool]] = None,
+                 concurrency: int = SCAN_CONCURRENCY,
+                 interval_minutes: float = SCAN_INTERVAL_MINUTES,
+                 jitter: float = SCAN_JITTER,
+                 budget_per_hour: float = SCAN_BUDGET_PER_HOUR):
+        self.run_group = run_group
+        self.saturated = saturated or (lambda: False)
+        self.concurrency = max(1, concurrency)
+        self.interval_minutes = interval_minutes
+        self.jitter = jitter
+        self.budget_per_hour = budget_per_hour
+        self.worker_id = worker_id()
+        self.queue: Optional[ScanJobQueue] = None
+        self.leader = False
+        self._running = False
+        self._stopping = False
+        self._in_flight: Dict[Any, asyncio.Task] = {}
+        self._last_cycle = 0.0
+        self._max_cycle = 0.0
+        self._intervals: Dict[str, float] = {}    # ключ группы -> интервал после раскладки бюджета
+        self._planned_at = 0.0
+        self._demand = 0.0
+        self._counters = {"cycles": 0, "skipped_ticks": 0, "groups": 0, "searches": 0,
+                          "deduplicated": 0, "enqueued": 0, "busy_keys": 0, "deferred": 0,
+                          "claimed": 0, "redelivered": 0, "lost_leases": 0, "errors": 0}
+
+    def next_run(self, now: datetime, minutes: Optional[float] = None) -> datetime:
+        spread = 1 + random.uniform(-self.jitter, self.jitter)
+        return now + timedelta(minutes=(minutes or self.interval_minutes) * spread)
+
+    def _desired(self, group: List[Dict[str, Any]]) -> float:
+        """Группа сканируется одним скрапингом — по самому «быстрому» из её поисков."""
+        return min(desired_interval(ss.get("rate_per_hour"), self.interval_minutes) for ss in group)
+
+    async def plan(self, db):
+        """Раскладка бюджета сканов в час по всем включённым поискам (группам) с учётом приоритета."""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        cur = db.saved_searches.find({"notifications_enabled": True},
+                                     {"query": 1, "filters": 1, "rate_per_hour": 1, "priority": 1})
+        async for ss in cur:
+            groups.setdefault(canonical_key(ss.get("query"), ss.get("filters")), []).append(ss)
+        demands = {key: (self._desired(g), max(float(ss.get("priority") or 1) for ss in g))
+                   for key, g in groups.items()}
+        self._intervals = allocate(demands, self.budget_per_hour)
+        self._demand = sum(60.0 / minutes for minutes, _ in demands.values())
+        self._planned_at = time.monotonic()
+
+    def interval_for(self, key: str, group: List[Dict[str, Any]]) -> float:
+        desired = self._desired(group)
+        planned = self._intervals.get(key)
+        return max(desired, planned) if planned else desired
+
+    async def attach_db(self, db):
+        if db is None:
+            return
+        self.queue = ScanJobQueue(db)
+        await self.queue.ensure_indexes()
+
+    # ------------------------------------------------------------------ producer
+    async def tick(self, db):
+        if db is None or self.queue is None:
+            return
+        if self._running:
+            self._counters["skipped_ticks"] += 1
+            return
+        self._running = True
+        started = time.monotonic()
+        try:
+            self.leader = await acquire_lease(db, PRODUCER_LEASE, self.worker_id, SCAN_TICK_SECONDS * 3)
+            if not self.leader:
+                return
+            if time.monotonic() - self._planned_at > PLAN_REFRESH_SECONDS:
+                await self.plan(db)
+            now = datetime.utcnow()
+            groups: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+            cur = db.saved_searches.find({
+                "notifications_enabled": True,
+                "$or": [{"next_run_at": {"$lte": now}}, {"next_run_at": {"$exists": False}}],
+            }, {"query": 1, "filters": 1, "rate_per_hour": 1, "priority": 1}).sort("next_run_at", 1)
+            async for ss in cur:
+                groups.setdefault(canonical_key(ss.get("query"), ss.get("filters")), []).append(ss)
+            if not groups:
+                return
+
+            searches = sum(len(g) for g in groups.values())
+            self._counters["searches"] += searches
+            self._counters["deduplicated"] += searches - len(groups)
+
+            scheduled: List[UpdateOne] = []
+            for key, group in groups.items():
+                ids = [ss["_id"] for ss in group]
+                if not await self.queue.enqueue(key, ids):
+                    self._counters["busy_keys"] += 1   # этот ключ сейчас сканируется — ждём следующий тик
+                    continue
+                self._counters["enqueued"] += 1
+                minutes = self.interval_for(key, group)
+                next_run_at = self.next_run(now, minutes)
+                scheduled += [UpdateOne({"_id": ss["_id"]}, {"$set": {
+                    "next_run_at": next_run_at,
+                    "interval_minutes": round(minutes, 1),
+                    "predicted_yield": predicted_yield(ss.get("rate_per_hour"), minutes),
+                }}) for ss in group]
+            if scheduled:
+                await db.saved_searches.bulk_write(scheduled, ordered=False)
+        finally:
+            self._running = False
+            self._last_cycle = time.monotonic() - started
+            self._max_cycle = max(self._max_cycle, self._last_cycle)
+            self._counters["cycles"] += 1
+
+    # ------------------------------------------------------------------ worker
+    async def run_worker(self, db):
+        """Цикл воркера до stop(): claim → скан в отдельной задаче → complete/release."""
+        if db is None or self.queue is None:
+            return
+        self._stopping = False
+        while not self._stopping:
+            try:
+                if len(self._in_flight) >= self.concurrency:
+                    await asyncio.sleep(SCAN_POLL_SECONDS)
+                    continue
+                if self.saturated():
+                    self._counters["deferred"] += 1
+                    await asyncio.sleep(SCAN_POLL_SECONDS)
+                    continue
+                job = await self.queue.claim(self.worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counters["errors"] += 1
+                errors_total.inc(where="scan_worker")
+                print(f"[scan worker error] {e}")
+                await asyncio.sleep(SCAN_POLL_SECONDS)
+                continue
+            if job is None:
+                await asyncio.sleep(SCAN_POLL_SECONDS)
+                continue
+            self._counters["claimed"] += 1
+            if job.get("attempts", 1) > 1:
+                self._counters["redelivered"] += 1
+            task = asyncio.create_task(self._process(db, job))
+            self._in_flight[job["_id"]] = task
+            task.add_done_callback(lambda _t, jid=job["_id"]: self._in_flight.pop(jid, None))
+
+    async def stop(self, timeout: float = 30):
+        """Новых задач не брать, текущим дать доработать (иначе lease истечёт и их заберут другие)."""
+        self._stopping = True
+        tasks = list(self._in_flight.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def _process(self, db, job: Dict[str, Any]):
+        beat = asyncio.create_task(self._heartbeat(job))
+        try:
+            cur = db.saved_searches.find({"_id": {"$in": job.get("search_ids", [])}, "notifications_enabled": True})
+            group = [ss async for ss in cur]
+            if group:
+                await self.run_group(group)
+                self._counters["groups"] += 1
+            await self.queue.complete(job, self.worker_id)
+        except Exception as e:
+            self._counters["errors"] += 1
+            errors_total.inc(where="periodic_scan")
+            print(f"[periodic_scan error] {e}")
+            try:
+                await self.queue.release(job, self.worker_id)
+            except Exception as e2:
+                print(f"[scan job release error] {e2}")
+        finally:
+            beat.cancel()
+
+    async def _heartbeat(self, job: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(max(1.0, self.queue.lease_seconds / 3))
+            try:
+                if not await self.queue.heartbeat(job, self.worker_id):
+                    self._counters["lost_leases"] += 1
+                    return
+            except Exception as e:
+                print(f"[scan heartbeat error] {e}")
+
+    def counters(self) -> Dict[str, Any]:
+        """Локальные счётчики процесса, без запроса к очереди (для /api/metrics)."""
+        return {**self._counters, "in_flight": len(self._in_flight), "leader": int(self.leader),
+                "last_cycle_s": self._last_cycle}
+
+    async def stats(self) -> Dict[str, Any]:
+        depth = {}
+        if self.queue is not None:
+            try:
+                depth = await self.queue.depth()
+            except Exception as e:
+                depth = {"error": str(e)}
+        return {
+            **self._counters,
+            "worker_id": self.worker_id,
+            "leader": self.leader,
+            "running": self._running,
+            "queue": depth,
+            "in_flight": len(self._in_flight),
+            "concurrency": self.concurrency,
+            "last_cycle_s": round(self._last_cycle, 2),
+            "max_cycle_s": round(self._max_cycle, 2),
+            "interval_minutes": self.interval_minutes,
+            "budget_per_hour": self.budget_per_hour,
+            "demand_per_hour": round(self._demand, 1),   # сколько сканов в час хотели бы все группы
+            "planned_per_hour": round(sum(60.0 / m for m in self._intervals.values()), 1),
+        }
@@ -1,117 +1,290 @@
+import asyncio
 import os
+import re
+import time
 from datetime import datetime
-from typing import List, Dict, Any, Union
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-
-SESSION_FILE = "/tmp/fb_context.json"
-FB_BASE = "https://m.facebook.com"  # mobile проще
-MARKETPLACE_SEARCH = "https://m.facebook.com/marketplace/?query={q}"
-
-LAUNCH_ARGS = [
-    "--no-sandbox",
-    "--disable-dev-shm-usage",
-    "--disable-gpu",
-    "--disable-setuid-sandbox",
-]
-
-def _launch(p):
-    return p.chromium.launch(headless=True, args=LAUNCH_ARGS)
-
-def _new_context(browser):
-    if os.path.exists(SESSION_FILE):
-        return browser.new_context(storage_state=SESSION_FILE)
-    return browser.new_context()
-
-def ensure_session_login() -> bool:
-    """Пытается создать storage_state из FB_EMAIL/FB_PASSWORD. Возвращает True при успехе."""
-    if os.path.exists(SESSION_FILE):
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator
+from playwright.async_api import TimeoutError as PWTimeout
+
+from app.core.metrics import errors_total
+from app.core.timing import span
+from app.marketplace.pool import get_pool
+from app.marketplace.filters import build_search_url, compile_predicate
+from app.marketplace.lean import lean_stats, policy_for, track_page
+from app.marketplace.listing import Listing
+from app.marketplace.session import DEFAULT_ACCOUNT, SessionManager, session_pool
+
+# mobile проще; переопределяются для офлайн-бенчмарка на локальных фикстурах (bench/bench_scanner.py)
+FB_BASE = os.getenv("FB_BASE", "https://m.facebook.com").rstrip("/")
+MARKETPLACE_SEARCH = os.getenv("MARKETPLACE_SEARCH", FB_BASE + "/marketplace/?query={q}")
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "45"))  # секунд на весь поиск
+MAX_CARDS = int(os.getenv("SEARCH_MAX_CARDS", "30"))
+CARD_SELECTOR = "article, div[role='article']"
+STREAM_TARGET = int(os.getenv("SEARCH_STREAM_TARGET", "300"))     # сколько объявлений собирать прокруткой
+STREAM_BUDGET = float(os.getenv("SEARCH_STREAM_BUDGET", "90"))     # секунд на весь стрим
+SCROLL_WAIT_MS = 4000        # ждём подгрузки после прокрутки
+SCROLL_IDLE_ROUNDS = 3       # столько пустых прокруток подряд = конец ленты
+LOGIN_RETRY_MINUTES = float(os.getenv("FB_LOGIN_RETRY_MINUTES", "15"))  # пауза после неудачного логина
+LOGIN_CONTEXT = ":login"     # отдельный контекст пула без cookies; ":" в имени аккаунта недопустимо
+
+_lean = policy_for(FB_BASE)
+
+def browser_pool():
+    return get_pool(storage_state=session_pool.storage_state, context_options=_lean.context_options(),
+                    setup_context=_lean.setup_context)
+
+session_pool.on_change(lambda name: browser_pool().invalidate_contexts(name))
+
+_login_lock: Optional[asyncio.Lock] = None
+_login_retry_at = 0.0
+
+async def ensure_session_login(force: bool = False) -> bool:
+    """
+    Пытается создать storage_state из FB_EMAIL/FB_PASSWORD. Возвращает True при успехе.
+    Логин идёт на браузере из пула; после неудачи следующая попытка — не раньше чем через
+    FB_LOGIN_RETRY_MINUTES (force — явный /api/auth/facebook/login), одновременные поиски ждут одну попытку.
+    """
+    global _login_lock, _login_retry_at
+    if session_pool.has_session():
         return True
     email = os.getenv("FB_EMAIL", "")
     password = os.getenv("FB_PASSWORD", "")
     if not email or not password:
         return False
-    with sync_playwright() as p:
-        browser = _launch(p)
-        context = browser.new_context()
-        page = context.new_page()
-        try:
-            page.goto(f"{FB_BASE}/login", wait_until="domcontentloaded", timeout=30000)
-            page.fill('input[name="email"]', email)
-            page.fill('input[name="pass"]', password)
-            try:
-                page.click('button[name="login"]', timeout=5000)
-            except PWTimeout:
-                page.keyboard.press("Enter")
-            page.wait_for_load_state("networkidle", timeout=30000)
-            context.storage_state(path=SESSION_FILE)
-            browser.close()
+    if _login_lock is None:
+        _login_lock = asyncio.Lock()
+    async with _login_lock:
+        if session_pool.has_session():
             return True
-        except Exception as e:
-            print(f"[FB LOGIN ERROR] {e}")
-            browser.close()
+        if not force and time.monotonic() < _login_retry_at:
             return False
+        ok = await _login(email, password)
+        _login_retry_at = 0.0 if ok else time.monotonic() + LOGIN_RETRY_MINUTES * 60
+        return ok
+
+async def _login(email: str, password: str) -> bool:
+    pool = browser_pool()
+    try:
+        async with pool.context(LOGIN_CONTEXT) as context:
+            page = await context.new_page()
+            try:
+                await page.goto(f"{FB_BASE}/login", wait_until="domcontentloaded", timeout=30000)
+                await page.fill('input[name="email"]', email)
+                await page.fill('input[name="pass"]', password)
+                try:
+                    await page.click('button[name="login"]', timeout=5000)
+                except PWTimeout:
+                    await page.keyboard.press("Enter")
+                await page.wait_for_load_state("networkidle", timeout=30000)
+                if is_blocked(page.url):
+                    raise SessionBlocked(page.url)
+                state = await context.storage_state()
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+        await session_pool.get(DEFAULT_ACCOUNT).set_state(state)
+        return True
+    except Exception as e:
+        errors_total.inc(where="fb_login")
+        print(f"[FB LOGIN ERROR] {e}")
+        return False
+    finally:
+        pool.invalidate_contexts(LOGIN_CONTEXT)   # cookies попытки не переживают её
 
 def has_session() -> bool:
-    return os.path.exists(SESSION_FILE)
+    return session_pool.has_session()
+
+async def search_marketplace(query: str, filters: Dict[str, Any],
+                             timeout: Optional[float] = None, max_cards: int = MAX_CARDS) -> List[Listing]:
+    """
+    Всегда возвращает список, даже при ошибке или таймауте (тогда пустой).
+    Отмена вызывающей задачи пробрасывается дальше, страница и слот пула освобождаются.
+    Логин (если сессии нет) входит в тот же таймаут.
+    """
+    try:
+        return await asyncio.wait_for(_login_and_search(query, filters, max_cards), timeout or SEARCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        errors_total.inc(where="search_timeout")
+        print(f"[SEARCH TIMEOUT] {query!r}")
+        return []
+    except Exception as e:
+        errors_total.inc(where="search")
+        print(f"[SEARCH ERROR] {e}")
+        return []
+
+class SessionBlocked(RuntimeError):
+    """Вместо выдачи Facebook показал checkpoint или форму логина."""
+
+def is_blocked(url: str) -> bool:
+    return "/checkpoint" in url or "/login" in url
+
+async def _open_search(page, query: str, filters: Dict[str, Any]):
+    track_page(page)
+    url = build_search_url(MARKETPLACE_SEARCH, query, filters)
+    started = time.monotonic()
+    with span("goto"):
+        await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+    lean_stats.record_load((time.monotonic() - started) * 1000)
+    if is_blocked(page.url):
+        raise SessionBlocked(page.url)
+    try:
+        with span("wait"):
+            await page.wait_for_selector(CARD_SELECTOR, timeout=15000)
+    except PWTimeout:
+        pass
+
+async def _close_page(context, page, acct: Optional[SessionManager], generation: int, blocked: bool):
+    if acct is not None and not blocked:
+        try:
+            # в память; на диск/в Mongo — только если cookies поменялись и сессию за время поиска не заменили
+            await acct.observe(await context.storage_state(), generation)
+        except Exception:
+            pass
+    try:
+        await page.close()
+    except Exception:
+        pass
+
+@asynccontextmanager
+async def _search_page(query: str, filters: Dict[str, Any]):
+    """
+    Страница выдачи на контексте очередного аккаунта из SessionPool.
+    Checkpoint/login wall отправляет аккаунт на cooldown и пробрасывает SessionBlocked.
+    """
+    acct = await session_pool.acquire()
+    generation = acct.generation if acct is not None else 0
+    async with browser_pool().context(acct.name if acct else None) as context:
+        page = await context.new_page()
+        blocked = False
+        try:
+            await _open_search(page, query, filters)
+            yield page
+        except SessionBlocked:
+            blocked = True
+            if acct is not None:
+                session_pool.report_blocked(acct)
+            raise
+        finally:
+            if acct is not None and not blocked:
+                session_pool.report_ok(acct)
+            await _close_page(context, page, acct, generation, blocked)
+
+async def _login_and_search(query: str, filters: Dict[str, Any], max_cards: int) -> List[Listing]:
+    await ensure_session_login()  # не критично, если не получится
+    return await _search(query, filters, max_cards)
 
-def search_marketplace(query: str, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Всегда возвращает список, даже при ошибке (тогда пустой)."""
-    _ = ensure_session_login()  # не критично, если не получится
+async def _search(query: str, filters: Dict[str, Any], max_cards: int) -> List[Listing]:
+    pred = compile_predicate(filters)
+    for attempt in range(2):
+        try:
+            async with _search_page(query, filters) as page:
+                return [x for x in await extract_cards(page, filters, max_cards) if pred(x)]
+        except SessionBlocked:
+            if attempt or not session_pool.has_session():
+                raise
+            # один повтор на другом аккаунте
+    return []
 
+async def iter_marketplace(query: str, filters: Dict[str, Any], target: int = STREAM_TARGET,
+                           time_budget: float = STREAM_BUDGET) -> AsyncIterator[Listing]:
+    """
+    Режим с прокруткой: отдаёт объявления по мере появления, пока не наберётся
+    `target` уникальных marketplace_id или не истечёт `time_budget` секунд.
+    Уже обработанные карточки помечаются в DOM, поэтому каждый раунд читает только новые.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget
     try:
-        with sync_playwright() as p:
-            browser = _launch(p)
-            context = _new_context(browser)
-            page = context.new_page()
-            url = MARKETPLACE_SEARCH.format(q=(query or "").strip())
-            page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        await asyncio.wait_for(ensure_session_login(), time_budget)   # логин — в счёт бюджета стрима
+    except asyncio.TimeoutError:
+        return
+    seen = set()
+    idle = 0
+    pred = compile_predicate(filters)
+
+    async with _search_page(query, filters) as page:
+        while len(seen) < target and loop.time() < deadline:
+            fresh = await extract_cards(page, filters, target - len(seen), only_new=True)
+            for item in fresh:
+                mid = item["marketplace_id"]
+                if mid and mid not in seen:
+                    seen.add(mid)
+                    if pred(item):
+                        yield item
+
+            before = await page.evaluate(_SCROLL_JS, CARD_SELECTOR)
+            wait_ms = min(SCROLL_WAIT_MS, max(0, int((deadline - loop.time()) * 1000)))
             try:
-                page.wait_for_selector("article, div[role='article']", timeout=15000)
+                await page.wait_for_function(
+                    "([sel, n]) => document.querySelectorAll(sel).length > n",
+                    arg=[CARD_SELECTOR, before], timeout=wait_ms or 1,
+                )
+                idle = 0
             except PWTimeout:
-                pass
+                idle += 1
+                if idle >= SCROLL_IDLE_ROUNDS:
+                    break  # лента закончилась
 
-            cards = page.query_selector_all("article, div[role='article']")
-            items: List[Dict[str, Any]] = []
+_SCROLL_JS = """
+(sel) => {
+    const n = document.querySelectorAll(sel).length;
+    window.scrollTo(0, document.body.scrollHeight);
+    return n;
+}
+"""
 
-            for card in cards[:30]:
-                try:
-                    title_el = card.query_selector("span, strong")
-                    title = (title_el.inner_text().strip() if title_el else "Listing")
-                    price_el = card.query_selector("span:has-text('$')")
-                    price = 0.0
-                    if price_el:
-                        raw = price_el.inner_text().replace("$", "").replace(",", "").strip()
-                        price = float(raw) if raw and raw.replace(".", "", 1).isdigit() else 0.0
-
-                    link_el = card.query_selector("a[href*='/marketplace/item/']")
-                    url_rel = link_el.get_attribute("href") if link_el else "/marketplace/"
-                    full_url = url_rel if url_rel.startswith("http") else (FB_BASE + url_rel)
-
-                    img_el = card.query_selector("img")
-                    img = img_el.get_attribute("src") if img_el else ""
-
-                    city = "—"
-
-                    items.append({
-                        "marketplace_id": full_url.split("/")[-1],
-                        "title": title,
-                        "price": price,
-                        "city": city,
-                        "category": filters.get("category") or "Miscellaneous",
-                        "image_url": img,
-                        "url": full_url,
-                        "published_at": datetime.utcnow().isoformat(),
-                        "condition": filters.get("condition", "Any"),
-                    })
-                except Exception:
-                    continue
+# Один проход по DOM внутри страницы вместо 4–5 IPC-вызовов на карточку.
+# Возвращает компактный массив [title, price_text, href, img_src, location].
+_EXTRACT_JS = """
+(cards, [limit, onlyNew]) => {
+    if (onlyNew) cards = cards.filter(c => !c.hasAttribute("data-mpf-seen"));
+    return cards.slice(0, limit).map(card => {
+        if (onlyNew) card.setAttribute("data-mpf-seen", "1");
+        const text = el => (el && el.innerText || "").trim();
+        const title = text(card.querySelector("span, strong")) || "Listing";
+        const spans = Array.from(card.querySelectorAll("span"));
+        const priceEl = spans.find(s => s.textContent.includes("$"));
+        const price = text(priceEl);
+        const link = card.querySelector("a[href*='/marketplace/item/']");
+        const img = card.querySelector("img");
+        let location = "";
+        for (let i = spans.length - 1; i >= 0; i--) {
+            const t = text(spans[i]);
+            if (t && t !== title && t !== price && !t.includes("$")) { location = t; break; }
+        }
+        return [title, price, link ? link.getAttribute("href") : "", img ? img.getAttribute("src") : "", location];
+    });
+}
+"""
 
-            try:
-                context.storage_state(path=SESSION_FILE)
-            except Exception:
-                pass
-            browser.close()
-            return items
-    except Exception as e:
-        print(f"[SEARCH ERROR] {e}")
-        return []
+_PRICE_RE = re.compile(r"\d+(?:\.\d+)?")
+_ITEM_ID_RE = re.compile(r"/marketplace/item/(\d+)")
+
+def _parse_prices(raw: List[str]) -> List[float]:
+    """"$1,200" -> 1200.0; "Free"/пусто -> 0.0. Одним проходом по всем карточкам."""
+    found = [_PRICE_RE.search(r.replace(",", "")) if r else None for r in raw]
+    return [float(m.group(0)) if m else 0.0 for m in found]
+
+def _marketplace_id(url: str) -> str:
+    m = _ITEM_ID_RE.search(url)
+    return m.group(1) if m else ""
+
+async def extract_cards(page, filters: Dict[str, Any], max_cards: int = MAX_CARDS,
+                        only_new: bool = False) -> List[Listing]:
+    with span("extract"):
+        rows = await page.eval_on_selector_all(CARD_SELECTOR, _EXTRACT_JS, [max_cards, only_new])
+        prices = _parse_prices([r[1] for r in rows])
+        category = filters.get("category") or "Miscellaneous"
+        condition = filters.get("condition", "Any")
+        now = datetime.utcnow().isoformat()
+
+        items: List[Listing] = []
+        for (title, _, href, img, location), price in zip(rows, prices):
+            url_rel = href or "/marketplace/"
+            full_url = url_rel if url_rel.startswith("http") else (FB_BASE + url_rel)
+            items.append(Listing(_marketplace_id(full_url), title, price, location or "—", category,
+                                 img or "", full_url, now, condition))
+        return items
@@ -0,0 +1,422 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.ratelimit import TokenBucket
+from app.core.timing import span
+
+SESSION_FILE = "/tmp/fb_context.json"
+SESSION_DOC_ID = "fb_storage_state"
+DEFAULT_ACCOUNT = "default"
+SESSION_PERSIST_DEBOUNCE = float(os.getenv("SESSION_PERSIST_DEBOUNCE", "10"))  # секунд
+SESSION_RATE_PER_MIN = float(os.getenv("SESSION_RATE_PER_MIN", "6"))           # поисков в минуту на аккаунт
+SESSION_BURST = float(os.getenv("SESSION_BURST", "3"))
+SESSION_COOLDOWN_MINUTES = float(os.getenv("SESSION_COOLDOWN_MINUTES", "30"))  # после checkpoint/login wall
+SESSION_WAIT = float(os.getenv("SESSION_WAIT", "30"))                          # сколько ждать свободный аккаунт
+SESSION_RELOAD_SECONDS = float(os.getenv("SESSION_RELOAD_SECONDS", "60"))      # проверка версий в Mongo; 0 — выкл.
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def valid_account_name(name: str) -> bool:
+    return bool(_NAME_RE.match(name or ""))
+
+
+def _doc_id(name: str) -> str:
+    return SESSION_DOC_ID if name == DEFAULT_ACCOUNT else f"{SESSION_DOC_ID}:{name}"
+
+
+def _path(name: str) -> str:
+    return SESSION_FILE if name == DEFAULT_ACCOUNT else SESSION_FILE.replace(".json", f".{name}.json")
+
+
+def state_hash(state: Optional[Dict[str, Any]]) -> str:
+    """Хэш только значимой части cookies: порядок и служебные поля (expires и т.п.) не важны."""
+    cookies = sorted(
+        (c.get("domain", ""), c.get("path", "/"), c.get("name", ""), c.get("value", ""))
+        for c in (state or {}).get("cookies", [])
+    )
+    return hashlib.sha1(json.dumps(cookies).encode("utf-8")).hexdigest()
+
+
+class SessionManager:
+    """
+    storage_state одного аккаунта Facebook в памяти процесса. Контексты браузера
+    получают его словарём (без файла), а в файл и Mongo он пишется только когда
+    cookies реально поменялись — с debounce, чтобы серия поисков давала одну запись.
+    Mongo — общий источник для всех процессов (API, worker.py), файл — локальная копия.
+    Замена сессии целиком (логин, загрузка cookies, очистка) увеличивает version документа:
+    другие процессы видят это в SessionPool.refresh и перечитывают сессию.
+    """
+
+    def __init__(self, name: str = DEFAULT_ACCOUNT, debounce: float = SESSION_PERSIST_DEBOUNCE):
+        self.name = name
+        self.doc_id = _doc_id(name)
+        self.path = _path(name)
+        self.debounce = debounce
+        self.db = None
+        self.state: Optional[Dict[str, Any]] = None
+        self._hash = state_hash(None)
+        self._persisted_hash = self._hash
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._listeners: List[Callable[[], None]] = []
+        self.writes = 0
+        self.version = -1    # version документа в Mongo, которую видел процесс; -1 — ещё не читали
+        self.generation = 0  # растёт при каждой замене сессии в этом процессе (логин, загрузка, sync, очистка)
+        # маршрутизация в SessionPool
+        self.bucket = TokenBucket(SESSION_RATE_PER_MIN / 60.0, SESSION_BURST)
+        self.last_used = 0.0
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.searches = 0
+        self.blocks = 0
+
+    def available(self, now: float) -> bool:
+        return self.has_session() and self.cooldown_until <= now
+
+    def on_change(self, fn: Callable[[], None]):
+        """fn вызывается, когда сессию заменили целиком (логин, загрузка cookies, очистка)."""
+        self._listeners.append(fn)
+
+    def has_session(self) -> bool:
+        return bool(self.state and self.state.get("cookies"))
+
+    def storage_state(self) -> Optional[Dict[str, Any]]:
+        return self.state if self.has_session() else None
+
+    async def load(self, db=None, doc: Optional[Dict[str, Any]] = None):
+        """
+        На старте: Mongo (sessions/_id=fb_storage_state[:name]), файл — только если документа
+        в Mongo нет: устаревший локальный файл не должен пережить загрузку cookies в другом процессе.
+        """
+        self.db = db
+        if doc is None and db is not None:
+            try:
+                with span("mongo_session_load"):
+                    doc = await db.sessions.find_one({"_id": self.doc_id})
+            except Exception as e:
+                print(f"[session load error] {e}")
+        state = None
+        if doc is not None:
+            self.version = doc.get("version", 0)
+            state = doc.get("storage_state")
+            if state is not None:
+                await asyncio.to_thread(self._write_file, state)
+        elif os.path.exists(self.path):
+            try:
+                state = await asyncio.to_thread(self._read_file)
+            except Exception as e:
+                print(f"[session load error] {e}")
+        if state is not None:
+            async with self._lock:
+                self._replace(state)
+                self._persisted_hash = self._hash
+
+    async def sync(self, doc: Dict[str, Any]):
+        """Документ из Mongo с новой version: сессию заменили в другом процессе — берём её."""
+        version = doc.get("version", 0)
+        if version == self.version:
+            return
+        state = doc.get("storage_state")
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            self.version = version
+            if state_hash(state) == self._hash:
+                self._persisted_hash = self._hash
+                return
+            self._replace(state)
+            self._persisted_hash = self._hash
+            self.cooldown_until = 0.0
+            self.strikes = 0
+            self._notify()
+        if state is not None:
+            await asyncio.to_thread(self._write_file, state)
+        elif os.path.exists(self.path):
+            await asyncio.to_thread(os.remove, self.path)
+
+    async def set_state(self, state: Dict[str, Any]):
+        """Новая сессия (логин / загрузка cookies): сразу в память, файл и Mongo."""
+        async with self._lock:
+            self._replace(state)
+            self.cooldown_until = 0.0
+            self.strikes = 0
+            self._notify()
+        await self.flush(replaced=True)
+
+    async def observe(self, state: Dict[str, Any], generation: Optional[int] = None):
+        """
+        Состояние после поиска: если cookies поменялись — запомнить и отложенно сохранить.
+        generation — та, что была при выдаче аккаунта поиску: если сессию с тех пор заменили,
+        контекст поиска держит старые cookies и затирать ими новую сессию нельзя.
+        """
+        h = state_hash(state)
+        if h == self._hash or (generation is not None and generation != self.generation):
+            return
+        async with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.state, self._hash = state, h
+        self._schedule_flush()
+
+    async def clear(self):
+        async with self._lock:
+            self._replace(None)
+            self._persisted_hash = self._hash
+            self._notify()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if os.path.exists(self.path):
+            await asyncio.to_thread(os.remove, self.path)
+        if self.db is not None:
+            async with self._lock:
+                await self._save(None, replaced=True)
+
+    async def flush(self, replaced: bool = False):
+        """
+        Пишет текущее состояние в файл и Mongo, если оно отличается от сохранённого.
+        replaced — сессию заменили целиком: version растёт, другие процессы её перечитают
+        (обновлённые после поиска cookies version не трогают — контексты там не пересоздаются).
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            state, h = self.state, self._hash
+            if state is None or h == self._persisted_hash:
+                return
+            if self.db is not None and not await self._save(state, replaced):
+                stale = True
+            else:
+                stale = False
+                await asyncio.to_thread(self._write_file, state)
+                self._persisted_hash = h
+                self.writes += 1
+        if stale:
+            await self._reload()
+
+    # ------------------------------------------------------------------ internals
+    async def _save(self, state: Optional[Dict[str, Any]], replaced: bool) -> bool:
+        """
+        False — документ в Mongo уже другой версии (сессию заменил другой процесс): обновлённые
+        cookies старой сессии не пишем. Замена целиком (replaced) пишется безусловно.
+        """
+        query: Dict[str, Any] = {"_id": self.doc_id}
+        update: Dict[str, Any] = {"$set": {"name": self.name, "storage_state": state}}
+        if replaced:
+            update["$inc"] = {"version": 1}
+        elif self.version > 0:
+            query["version"] = self.version
+        else:   # документа не было или он без version (записан до её появления)
+            query["version"] = {"$in": [0, None]}
+        try:
+            with span("mongo_session_save"):
+                doc = await self.db.sessions.find_one_and_update(
+                    query, update, projection={"version": 1}, upsert=True, return_document=True,
+                )
+        except Exception as e:
+            if getattr(e, "code", None) == 11000:   # фильтр по version не совпал -> upsert упёрся в _id
+                return False
+            raise
+        if replaced and doc is not None:
+            self.version = doc.get("version", 0)   # свою замену повторно не перечитываем
+        return True
+
+    async def _reload(self):
+        with span("mongo_session_load"):
+            doc = await self.db.sessions.find_one({"_id": self.doc_id})
+        if doc is not None:
+            await self.sync(doc)
+
+    def _replace(self, state: Optional[Dict[str, Any]]):
+        self.state = state
+        self._hash = state_hash(state)
+        self.generation += 1
+
+    def _notify(self):
+        for fn in self._listeners:
+            fn()
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(self.debounce, lambda: asyncio.ensure_future(self._flush_safe()))
+
+    async def _flush_safe(self):
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[session persist error] {e}")
+
+    def _read_file(self) -> Dict[str, Any]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_file(self, state: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "authenticated": self.has_session(),
+            "cookies": len((self.state or {}).get("cookies", [])),
+            "searches": self.searches,
+            "blocks": self.blocks,
+            "cooldown_s": max(0, round(self.cooldown_until - now)),
+            "tokens": round(self.bucket.tokens, 2),
+            "idle_s": round(now - self.last_used) if self.last_used else None,
+            "writes": self.writes,
+        }
+
+
+class SessionUnavailable(RuntimeError):
+    """Все аккаунты на cooldown или исчерпали лимит дольше SESSION_WAIT."""
+
+
+class SessionPool:
+    """
+    Несколько аккаунтов (документы sessions/_id=fb_storage_state[:name]).
+    Поиск получает наименее давно использованный здоровый аккаунт со свободным
+    токеном; аккаунты, упёршиеся в checkpoint/login wall, уходят на cooldown.
+    """
+
+    def __init__(self):
+        self.accounts: Dict[str, SessionManager] = {}
+        self.db = None
+        self._listeners: List[Callable[[str], None]] = []
+        self._watch: Optional[asyncio.Task] = None
+
+    def on_change(self, fn: Callable[[str], None]):
+        """fn(name) — сессия аккаунта заменена целиком (контексты нужно пересоздать)."""
+        self._listeners.append(fn)
+
+    def get(self, name: str = DEFAULT_ACCOUNT) -> SessionManager:
+        acct = self.accounts.get(name)
+        if acct is None:
+            acct = SessionManager(name)
+            acct.db = self.db
+
+            def changed(n=name):
+                for fn in self._listeners:
+                    fn(n)
+
+            acct.on_change(changed)
+            self.accounts[name] = acct
+        return acct
+
+    async def load(self, db=None):
+        self.db = db
+        docs: Dict[str, Dict[str, Any]] = {}
+        if db is not None:
+            try:
+                with span("mongo_session_load"):
+                    async for doc in db.sessions.find({"_id": {"$regex": f"^{SESSION_DOC_ID}"}}):
+                        name = doc["_id"].partition(":")[2] or DEFAULT_ACCOUNT
+                        docs[name] = doc
+            except Exception as e:
+                print(f"[session load error] {e}")
+        for name in set(docs) | {DEFAULT_ACCOUNT}:
+            acct = self.get(name)
+            await acct.load(db, docs.get(name))
+
+    async def refresh(self):
+        """
+        Сессии, заменённые в другом процессе (загрузка cookies, логин, очистка, новый аккаунт):
+        читаются только версии, документ целиком — лишь у изменившихся.
+        """
+        if self.db is None:
+            return
+        with span("mongo_session_versions"):
+            versions = {doc["_id"]: doc.get("version", 0)
+                        async for doc in self.db.sessions.find({"_id": {"$regex": f"^{SESSION_DOC_ID}"}}, {"version": 1})}
+        for doc_id, version in versions.items():
+            acct = self.get(doc_id.partition(":")[2] or DEFAULT_ACCOUNT)
+            if acct.version == version:
+                continue
+            doc = await self.db.sessions.find_one({"_id": doc_id})
+            if doc is not None:
+                await acct.sync(doc)
+
+    def start_watch(self, interval: float = SESSION_RELOAD_SECONDS):
+        """Фоновая refresh раз в `interval` секунд; без Mongo делить сессию не с кем."""
+        if self.db is None or interval <= 0 or self._watch is not None:
+            return
+        self._watch = asyncio.create_task(self._watch_loop(interval))
+
+    def stop_watch(self):
+        if self._watch is not None:
+            self._watch.cancel()
+            self._watch = None
+
+    async def _watch_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"[session reload error] {e}")
+
+    def has_session(self) -> bool:
+        return any(a.has_session() for a in self.accounts.values())
+
+    def storage_state(self, name: str) -> Optional[Dict[str, Any]]:
+        acct = self.accounts.get(name)
+        return acct.storage_state() if acct is not None else None
+
+    async def acquire(self, wait: float = SESSION_WAIT) -> Optional[SessionManager]:
+        """
+        LRU-аккаунт с токеном. None — аккаунтов с сессией нет вовсе (поиск без логина).
+        Если все заняты лимитом/cooldown — ждём ближайший, но не дольше `wait`.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            now = time.monotonic()
+            live = [a for a in self.accounts.values() if a.has_session()]
+            if not live:
+                return None
+            ready = sorted((a for a in live if a.available(now)), key=lambda a: a.last_used)
+            for acct in ready:
+                if acct.bucket.try_acquire():
+                    acct.last_used = now
+                    acct.searches += 1
+                    return acct
+            waits = [a.bucket.wait_time() for a in ready] + [a.cooldown_until - now for a in live if not a.available(now)]
+            delay = min(waits) if waits else 1.0
+            if now + delay > deadline:
+                raise SessionUnavailable("all sessions are rate-limited or cooling down")
+            await asyncio.sleep(max(0.05, delay))
+
+    def report_blocked(self, acct: SessionManager):
+        """Checkpoint/login wall: экспоненциальный cooldown (30м, 1ч, 2ч, ... до 16x)."""
+        acct.blocks += 1
+        acct.strikes += 1
+        minutes = SESSION_COOLDOWN_MINUTES * (2 ** min(acct.strikes - 1, 4))
+        acct.cooldown_until = time.monotonic() + minutes * 60
+        print(f"[SESSION] {acct.name} blocked, cooling down {minutes:g} min")
+
+    def report_ok(self, acct: SessionManager):
+        acct.strikes = 0
+
+    async def flush(self):
+        for acct in self.accounts.values():
+            await acct.flush()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [a.snapshot(now) for a in sorted(self.accounts.values(), key=lambda a: a.name)]
+
+
+session_pool = SessionPool()
@@ -0,0 +1,68 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+# Частота сканов по «скорости» поиска: сколько новых объявлений в час он приносит.
+SCAN_INTERVAL_MINUTES = float(os.getenv("SCAN_INTERVAL_MINUTES", "10"))    # пока скорость неизвестна
+SCAN_MIN_MINUTES = float(os.getenv("SCAN_MIN_MINUTES", "2"))
+SCAN_MAX_MINUTES = float(os.getenv("SCAN_MAX_MINUTES", "120"))
+SCAN_TARGET_YIELD = float(os.getenv("SCAN_TARGET_YIELD", "1"))             # новых объявлений на скан
+SCAN_EWMA_ALPHA = float(os.getenv("SCAN_EWMA_ALPHA", "0.3"))
+SCAN_BUDGET_PER_HOUR = float(os.getenv("SCAN_BUDGET_PER_HOUR", "120"))     # скрапингов в час на всех; 0 — без лимита
+
+
+def _clamp(minutes: float) -> float:
+    return min(SCAN_MAX_MINUTES, max(SCAN_MIN_MINUTES, minutes))
+
+
+def observe_yield(ss: Mapping[str, Any], new_count: int, now: datetime) -> Dict[str, float]:
+    """
+    EWMA новых объявлений в час по итогам скана (поля для $set в saved_searches).
+    Скорость в час, а не «на скан»: интервалы у скана разные, и так они сравнимы.
+    """
+    hours = max((now - ss["last_scan_at"]).total_seconds() / 3600, 1 / 60)
+    rate = new_count / hours
+    prev = ss.get("rate_per_hour")
+    ewma = rate if prev is None else SCAN_EWMA_ALPHA * rate + (1 - SCAN_EWMA_ALPHA) * prev
+    return {"rate_per_hour": round(ewma, 4)}
+
+
+def desired_interval(rate_per_hour: Optional[float], default: float = SCAN_INTERVAL_MINUTES) -> float:
+    """Интервал, за который набегает SCAN_TARGET_YIELD новых объявлений; тихий поиск — до потолка."""
+    if rate_per_hour is None:
+        return _clamp(default)
+    if rate_per_hour <= 0:
+        return SCAN_MAX_MINUTES
+    return _clamp(60 * SCAN_TARGET_YIELD / rate_per_hour)
+
+
+def predicted_yield(rate_per_hour: Optional[float], interval_minutes: float) -> Optional[float]:
+    return None if rate_per_hour is None else round(rate_per_hour * interval_minutes / 60, 2)
+
+
+def allocate(groups: Mapping[str, Tuple[float, float]], budget_per_hour: float = SCAN_BUDGET_PER_HOUR) -> Dict[str, float]:
+    """
+    groups: ключ -> (желаемый интервал, мин; приоритет). Если сумма 60/интервал влезает в бюджет —
+    все получают желаемое. Иначе бюджет делится пропорционально приоритету (water-filling:
+    кому хватает меньше доли, берёт своё, остаток делят остальные). Интервал не выходит за
+    [желаемый, SCAN_MAX_MINUTES] — потолок важнее бюджета.
+    """
+    want = {k: 60.0 / minutes for k, (minutes, _) in groups.items()}
+    if budget_per_hour <= 0 or sum(want.values()) <= budget_per_hour:
+        return {k: minutes for k, (minutes, _) in groups.items()}
+    weight = {k: max(0.1, priority) for k, (_, priority) in groups.items()}
+    grant: Dict[str, float] = {}
+    left, open_ = budget_per_hour, set(groups)
+    while open_:
+        total = sum(weight[k] for k in open_)
+        share = {k: left * weight[k] / total for k in open_}
+        done = {k for k in open_ if want[k] <= share[k]}
+        if not done:
+            grant.update(share)
+            break
+        for k in done:
+            grant[k] = want[k]
+            left -= want[k]
+        open_ -= done
+    return {k: min(SCAN_MAX_MINUTES, max(groups[k][0], 60.0 / grant[k] if grant[k] > 0 else SCAN_MAX_MINUTES))
+            for k in groups}
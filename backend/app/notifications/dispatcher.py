@@ -0,0 +1,157 @@
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.metrics import errors_total
+from app.core.timing import span
+from app.notifications.emailer import send_email, smtp_session
+from app.notifications.pushover import send_push
+
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "2"))
+NOTIFY_DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", "60"))   # окно группировки
+NOTIFY_RETRIES = int(os.getenv("NOTIFY_RETRIES", "4"))
+NOTIFY_BACKOFF = float(os.getenv("NOTIFY_BACKOFF", "2"))                 # секунд, удваивается
+NOTIFY_QUEUE = 10000
+
+
+class NotificationDispatcher:
+    """
+    Асинхронная очередь уведомлений: scan-цикл только кладёт новые объявления,
+    отправка (SMTP/Pushover — блокирующие клиенты) идёт в воркерах через to_thread.
+    Объявления копятся в дайджест по (канал, получатель) в течение окна и уходят одним сообщением.
+    """
+
+    def __init__(self, workers: int = NOTIFY_WORKERS, digest_seconds: float = NOTIFY_DIGEST_SECONDS,
+                 retries: int = NOTIFY_RETRIES, backoff: float = NOTIFY_BACKOFF):
+        self.workers = max(1, workers)
+        self.digest_seconds = digest_seconds
+        self.retries = retries
+        self.backoff = backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._digests: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._counters = {"listings": 0, "price_drops": 0, "messages": 0, "sent": 0, "retries": 0, "failed": 0, "dropped": 0}
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=NOTIFY_QUEUE)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        """Досылает открытые дайджесты и ждёт очередь (не дольше timeout)."""
+        if self._queue is None:
+            return
+        for key in list(self._digests):
+            self._flush(key)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        await asyncio.to_thread(smtp_session.close)
+
+    def notify_listings(self, recipient: str, query: str, items: List[Dict[str, Any]]):
+        """Добавляет новые объявления в дайджесты email и push для получателя."""
+        if not items:
+            return
+        self._counters["listings"] += len(items)
+        self._add(recipient, [{**x, "_query": query} for x in items])
+
+    def notify_price_drops(self, recipient: str, query: str, drops: List[Tuple[Dict[str, Any], float]]):
+        """Снижения цены — (объявление, прежняя цена) — в те же дайджесты."""
+        if not drops:
+            return
+        self._counters["price_drops"] += len(drops)
+        self._add(recipient, [{**x, "_query": query, "_old_price": old} for x, old in drops])
+
+    def _add(self, recipient: str, entries: List[Dict[str, Any]]):
+        for channel, to in (("email", recipient), ("push", "")):
+            key = (channel, to)
+            self._digests.setdefault(key, []).extend(entries)
+            if key not in self._timers:
+                loop = asyncio.get_running_loop()
+                self._timers[key] = loop.call_later(self.digest_seconds, self._flush, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "open_digests": len(self._digests),
+            "smtp_connects": smtp_session.connects,
+            "smtp_sent": smtp_session.sent,
+        }
+
+    # ------------------------------------------------------------------ internals
+    def _flush(self, key: Tuple[str, str]):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._digests.pop(key, [])
+        if not items or self._queue is None:
+            return
+        channel, to = key
+        job = _email_job(to, items) if channel == "email" else _push_job(items)
+        try:
+            self._queue.put_nowait(job)
+            self._counters["messages"] += 1
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+
+    async def _worker(self):
+        while True:
+            fn, args = await self._queue.get()
+            try:
+                await self._deliver(fn, args)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, fn: Callable[..., Any], args: tuple):
+        for attempt in range(self.retries + 1):
+            try:
+                with span(fn.__name__):
+                    await asyncio.to_thread(fn, *args)
+                self._counters["sent"] += 1
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self._counters["failed"] += 1
+                    errors_total.inc(where="notify")
+                    print(f"[notify error] {fn.__name__}: {e}")
+                    return
+                self._counters["retries"] += 1
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+
+def _price(x: Dict[str, Any]) -> str:
+    if "_old_price" in x:
+        return f"${x['_old_price']:g} -> ${x.get('price', 0):g}"
+    return f"${x.get('price', 0):g}"
+
+
+def _email_job(to: str, items: List[Dict[str, Any]]):
+    drops = sum(1 for x in items if "_old_price" in x)
+    if not drops:
+        subject = "New Marketplace item" if len(items) == 1 else f"{len(items)} new Marketplace items"
+    elif drops == len(items):
+        subject = "Marketplace price drop" if drops == 1 else f"{drops} Marketplace price drops"
+    else:
+        subject = f"{len(items) - drops} new Marketplace items, {drops} price drops"
+    lines = [f"{x['title']} — {_price(x)} — {x['url']}  [{x['_query']}]" for x in items]
+    return send_email, (to, subject, "\n".join(lines))
+
+
+def _push_job(items: List[Dict[str, Any]]):
+    first = items[0]
+    more = f" (+{len(items) - 1} more)" if len(items) > 1 else ""
+    if "_old_price" in first:
+        return send_push, ("Marketplace Finder", f"Price drop: {first['title']} {_price(first)}{more}")
+    return send_push, ("Marketplace Finder", f"New item: {first['title']}{more}")
+
+
+dispatcher = NotificationDispatcher()
@@ -1,10 +1,63 @@
-import os, smtplib
+import os, smtplib, threading
 from email.mime.text import MIMEText
 
 SMTP_HOST=os.getenv('SMTP_HOST')
 SMTP_PORT=int(os.getenv('SMTP_PORT') or 587)
 SMTP_USER=os.getenv('SMTP_USER')
 SMTP_PASS=os.getenv('SMTP_PASS')
+SMTP_STARTTLS=os.getenv('SMTP_STARTTLS', '1') not in ('0', 'false', 'False')
+SMTP_TIMEOUT=float(os.getenv('SMTP_TIMEOUT') or 20)
+
+class SMTPSession:
+    """Одно SMTP-соединение (STARTTLS + login один раз) на много писем; при обрыве переподключается."""
+
+    def __init__(self):
+        self._smtp = None
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.sent = 0
+
+    def _connect(self):
+        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            s.starttls()
+        s.login(SMTP_USER, SMTP_PASS)
+        self._smtp = s
+        self.connects += 1
+
+    def send(self, to:str, msg:MIMEText):
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._smtp is None:
+                        self._connect()
+                    self._smtp.sendmail(SMTP_USER, [to], msg.as_string())
+                    self.sent += 1
+                    return
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # сервер закрыл простаивающее соединение — пробуем ещё раз на свежем
+                    self._drop()
+                    if attempt:
+                        raise
+
+    def _drop(self):
+        try:
+            if self._smtp is not None:
+                self._smtp.close()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def close(self):
+        with self._lock:
+            try:
+                if self._smtp is not None:
+                    self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+smtp_session = SMTPSession()
 
 def send_email(to:str, subject:str, body:str):
     if not (SMTP_HOST and SMTP_USER and SMTP_PASS):
@@ -13,8 +66,5 @@ def send_email(to:str, subject:str, body:str):
     msg['Subject']=subject
     msg['From']=SMTP_USER
     msg['To']=to
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-        s.starttls()
-        s.login(SMTP_USER, SMTP_PASS)
-        s.sendmail(SMTP_USER, [to], msg.as_string())
+    smtp_session.send(to, msg)
     return True
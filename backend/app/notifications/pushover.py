@@ -1,18 +1,37 @@
 import os
-import requests
 
-def push(title: str, message: str):
+PUSHOVER_URL = os.getenv("PUSHOVER_URL", "https://api.pushover.net/1/messages.json")
+PUSHOVER_TIMEOUT = float(os.getenv("PUSHOVER_TIMEOUT", "10"))
+
+# Один Session на процесс: keep-alive и пул соединений вместо нового TLS на каждый push.
+# requests импортируется при первом push, а не при старте API.
+_session = None
+
+def _http():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+def send_push(title: str, message: str) -> bool:
+    """Отправляет push; False, если Pushover не настроен. Ошибки HTTP/сети пробрасывает (для ретраев)."""
     user = os.getenv("PUSHOVER_USER")
     token = os.getenv("PUSHOVER_TOKEN")
 
     # Если переменных нет — просто логируем
     if not user or not token:
         print(f"[PUSHOVER disabled] {title}: {message}")
-        return
+        return False
 
     data = {"token": token, "user": user, "title": title, "message": message}
+    r = _http().post(PUSHOVER_URL, data=data, timeout=PUSHOVER_TIMEOUT)
+    print(f"[PUSHOVER] {r.status_code}: {r.text}")
+    r.raise_for_status()
+    return True
+
+def push(title: str, message: str):
     try:
-        r = requests.post("https://api.pushover.net/1/messages.json", data=data)
-        print(f"[PUSHOVER] {r.status_code}: {r.text}")
+        send_push(title, message)
     except Exception as e:
         print(f"[PUSHOVER error] {e}")
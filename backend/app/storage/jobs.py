@@ -0,0 +1,130 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+JOB_LEASE_SECONDS = int(os.getenv("SCAN_JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("SCAN_JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_SECONDS = int(os.getenv("SCAN_JOB_RETRY_SECONDS", "60"))
+JOB_KEEP_HOURS = 24  # выполненные задачи живут сутки (TTL), для отладки
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class ScanJobQueue:
+    """
+    Очередь сканов в Mongo (коллекция scan_jobs). Одна задача = группа сохранённых
+    поисков с одинаковым canonical_key. Пока задача активна (queued/leased), вторую
+    с тем же ключом поставить нельзя (частичный уникальный индекс по key).
+    Захват — атомарный find_one_and_update с lease; истёкший lease = повторная выдача,
+    но не больше JOB_MAX_ATTEMPTS раз: задача, что роняет/вешает воркер и до release не доходит,
+    списывается в failed при следующем захвате.
+    """
+
+    def __init__(self, db, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.db = db
+        self.lease_seconds = lease_seconds
+
+    async def ensure_indexes(self):
+        jobs = self.db.scan_jobs
+        await jobs.create_index("key", unique=True, partialFilterExpression={"active": True})
+        await jobs.create_index([("active", ASCENDING), ("status", ASCENDING), ("enqueued_at", ASCENDING)])
+        await jobs.create_index("finished_at", expireAfterSeconds=JOB_KEEP_HOURS * 3600)
+
+    async def enqueue(self, key: str, search_ids: List[Any]) -> bool:
+        """False — по этому ключу уже идёт скан (задача leased), поиски подождут следующего тика."""
+        now = datetime.utcnow()
+        try:
+            await self.db.scan_jobs.update_one(
+                {"key": key, "active": True, "status": "queued"},
+                {
+                    "$setOnInsert": {"enqueued_at": now, "not_before": now, "attempts": 0},
+                    "$addToSet": {"search_ids": {"$each": search_ids}},
+                },
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        await self.db.scan_jobs.update_many(
+            {"active": True, "status": "leased", "lease_until": {"$lt": now}, "attempts": {"$gte": JOB_MAX_ATTEMPTS}},
+            {"$set": {"status": "failed", "finished_at": now}, "$unset": {"active": ""}},
+        )
+        return await self.db.scan_jobs.find_one_and_update(
+            {
+                "active": True,
+                "$or": [
+                    {"status": "queued", "not_before": {"$lte": now}},
+                    {"status": "leased", "lease_until": {"$lt": now}, "attempts": {"$lt": JOB_MAX_ATTEMPTS}},
+                ],
+            },
+            {
+                "$set": {"status": "leased", "worker": worker, "started_at": now,
+                         "lease_until": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("enqueued_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def heartbeat(self, job: Dict[str, Any], worker: str) -> bool:
+        """Продлевает lease; False — lease уже потерян (задачу забрал другой воркер)."""
+        res = await self.db.scan_jobs.update_one(
+            {"_id": job["_id"], "worker": worker, "status": "leased"},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return res.matched_count == 1
+
+    async def complete(self, job: Dict[str, Any], worker: str, status: str = "done"):
+        await self.db.scan_jobs.update_one(
+            {"_id": job["_id"], "worker": worker},
+            {"$set": {"status": status, "finished_at": datetime.utcnow()}, "$unset": {"active": ""}},
+        )
+
+    async def release(self, job: Dict[str, Any], worker: str):
+        """Ошибка скана: вернуть в очередь с задержкой или списать после JOB_MAX_ATTEMPTS."""
+        if job.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+            await self.complete(job, worker, status="failed")
+            return
+        delay = JOB_RETRY_SECONDS * job.get("attempts", 1)
+        await self.db.scan_jobs.update_one(
+            {"_id": job["_id"], "worker": worker},
+            {"$set": {"status": "queued", "not_before": datetime.utcnow() + timedelta(seconds=delay)},
+             "$unset": {"worker": "", "lease_until": ""}},
+        )
+
+    async def depth(self) -> Dict[str, int]:
+        out = {"queued": 0, "leased": 0}
+        async for row in self.db.scan_jobs.aggregate([
+            {"$match": {"active": True}},
+            {"$group": {"_id": "$status", "n": {"$sum": 1}}},
+        ]):
+            out[row["_id"]] = row["n"]
+        return out
+
+
+async def acquire_lease(db, name: str, holder: str, ttl_seconds: int) -> bool:
+    """
+    Выбор лидера: документ leases/_id=name принадлежит holder до until.
+    Продлить может только текущий владелец, захватить — кто угодно после истечения.
+    """
+    now = datetime.utcnow()
+    try:
+        doc = await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"holder": holder}, {"until": {"$lt": now}}]},
+            {"$set": {"holder": holder, "until": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return False  # лидер есть и его lease ещё жив
+    return doc is not None and doc.get("holder") == holder
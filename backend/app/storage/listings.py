@@ -0,0 +1,160 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, UpdateOne
+
+from app.marketplace.filters import CONDITION_PARAMS
+from app.marketplace.geo import Point, geo_point, within_radius
+
+UPSERT_BATCH = 500
+MAX_PAGE = 200
+
+# sort_by -> (поле, направление); _id добавляется как tie-breaker для курсора
+_SORTS = {
+    "date_desc": ("published_at", DESCENDING),
+    "price_asc": ("price", ASCENDING),
+    "price_desc": ("price", DESCENDING),
+}
+
+_FIELDS = ("title", "price", "image_url", "url")
+_NO_CATEGORY = ("", "Miscellaneous")
+_NO_CITY = ("", "—")
+
+
+async def ensure_listing_indexes(db):
+    await db.listings.create_index("marketplace_id", unique=True)
+    await db.listings.create_index([("published_at", DESCENDING), ("_id", DESCENDING)])
+    await db.listings.create_index([("price", ASCENDING), ("_id", ASCENDING)])
+    await db.listings.create_index("categories")
+    await db.listings.create_index("city")
+    await db.listings.create_index([("title", TEXT)])
+    await db.listings.create_index([("geo", GEOSPHERE)])  # радиус-поиск; объявления без координат не индексируются
+
+
+def _as_datetime(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+async def upsert_listings(db, items: List[Dict[str, Any]]) -> int:
+    """
+    bulk_write upsert по marketplace_id пачками. published_at — самое раннее из известных:
+    время первого скрапинга, пока enrichment не принесёт настоящую дату публикации.
+    Город и состояние перезаписываются только настоящими значениями: у карточки без города
+    стоит «—», а состояние «Any» — эхо фильтра запроса; они не затирают данные со страницы объявления.
+    Категория у карточки — тоже фильтр запроса, а не свойство объявления: она копится в categories
+    (в поисках каких категорий объявление встречалось), category — метка первого скрапинга.
+    """
+    now = datetime.utcnow()
+    ops = []
+    for item in items:
+        mid = item.get("marketplace_id")
+        if not mid:
+            continue
+        fields = {k: item.get(k) for k in _FIELDS}
+        on_insert: Dict[str, Any] = {"first_seen": now, "category": item.get("category") or "Miscellaneous"}
+        if item.get("description"):
+            fields["description"] = item["description"]  # без enrichment описания нет — не затираем
+        city = item.get("city") or ""
+        if city in _NO_CITY:
+            on_insert["city"] = "—"
+        else:
+            fields["city"] = city
+            geo = geo_point(city)
+            if geo:
+                fields["geo"] = geo
+        condition = item.get("condition") or "Any"
+        if condition.lower() in CONDITION_PARAMS:   # со страницы объявления или фильтр, который marketplace применил сам
+            fields["condition"] = condition
+        else:
+            on_insert["condition"] = condition
+        update = {
+            "$set": {**fields, "last_seen": now},
+            "$min": {"published_at": _as_datetime(item.get("published_at"))},
+            "$setOnInsert": on_insert,
+        }
+        category = item.get("category") or ""
+        if category not in _NO_CATEGORY:
+            update["$addToSet"] = {"categories": category}
+        ops.append(UpdateOne({"marketplace_id": mid}, update, upsert=True))
+    written = 0
+    for i in range(0, len(ops), UPSERT_BATCH):
+        res = await db.listings.bulk_write(ops[i:i + UPSERT_BATCH], ordered=False)
+        written += res.upserted_count + res.modified_count
+    return written
+
+
+def _encode_cursor(value: Any, oid: ObjectId) -> str:
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps([value, str(oid)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    value, oid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if isinstance(value, dict) and "$date" in value:
+        value = datetime.fromisoformat(value["$date"])
+    return value, ObjectId(oid)
+
+
+def _public(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc = {**doc, "_id": str(doc["_id"])}
+    for k in ("published_at", "first_seen", "last_seen"):
+        if isinstance(doc.get(k), datetime):
+            doc[k] = doc[k].isoformat()
+    return doc
+
+
+async def query_listings(db, q: Optional[str] = None, category: Optional[str] = None, city: Optional[str] = None,
+                         price_min: Optional[float] = None, price_max: Optional[float] = None,
+                         near: Optional[Point] = None, radius_miles: Optional[float] = None,
+                         sort_by: Optional[str] = "date_desc", cursor: Optional[str] = None,
+                         limit: int = 50) -> Dict[str, Any]:
+    """
+    Выборка из сохранённых объявлений с keyset-пагинацией: курсор — (значение поля сортировки, _id)
+    последнего элемента, поэтому каждая страница идёт по индексу без skip. near + radius_miles —
+    объявления в радиусе от точки (2dsphere-индекс по geo). category — объявления, найденные
+    поиском с этой категорией.
+    """
+    field, direction = _SORTS.get(sort_by or "date_desc", _SORTS["date_desc"])
+    limit = max(1, min(limit, MAX_PAGE))
+
+    clauses: List[Dict[str, Any]] = []
+    if q:
+        clauses.append({"$text": {"$search": q}})
+    if category:
+        clauses.append({"categories": category})
+    if city:
+        clauses.append({"city": city})
+    price: Dict[str, Any] = {}
+    if price_min is not None:
+        price["$gte"] = price_min
+    if price_max is not None:
+        price["$lte"] = price_max
+    if price:
+        clauses.append({"price": price})
+    if near is not None and radius_miles:
+        clauses.append({"geo": within_radius(near, radius_miles)})
+    if cursor:
+        value, oid = _decode_cursor(cursor)
+        op = "$lt" if direction == DESCENDING else "$gt"
+        clauses.append({"$or": [{field: {op: value}}, {field: value, "_id": {op: oid}}]})
+
+    spec = {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+    cur = db.listings.find(spec).sort([(field, direction), ("_id", direction)]).limit(limit + 1)
+    docs = [d async for d in cur]
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = _encode_cursor(last.get(field), last["_id"])
+    return {"listings": [_public(d) for d in docs], "next_cursor": next_cursor}
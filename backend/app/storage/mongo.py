@@ -0,0 +1,32 @@
+from typing import Any, Optional
+
+MONGO_DB_NAME = "mpf"
+
+
+class LazyDatabase:
+    """
+    База Mongo, которая импортирует motor и создаёт клиент при первом обращении к коллекции,
+    а не при импорте API. Дальше ведёт себя как AsyncIOMotorDatabase (db.listings, db["x"], db.command).
+    """
+
+    def __init__(self, url: str, name: str = MONGO_DB_NAME):
+        self._url = url
+        self._name = name
+        self._db = None
+
+    def _get(self):
+        if self._db is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._db = AsyncIOMotorClient(self._url)[self._name]
+        return self._db
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._get(), attr)
+
+    def __getitem__(self, name: str) -> Any:
+        return self._get()[name]
+
+
+def connect(url: Optional[str], name: str = MONGO_DB_NAME) -> Optional[LazyDatabase]:
+    """None, если MONGO_URL не задан."""
+    return LazyDatabase(url, name) if url else None
@@ -0,0 +1,51 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+SEEN_TTL_DAYS = int(os.getenv("SEEN_TTL_DAYS", "30"))  # сколько помнить объявление, которое больше не попадается
+
+
+async def ensure_seen_indexes(db):
+    """Уникальный (search_id, marketplace_id) + TTL по last_seen."""
+    await db.seen_listings.create_index([("search_id", 1), ("marketplace_id", 1)], unique=True)
+    await db.seen_listings.create_index("last_seen", expireAfterSeconds=SEEN_TTL_DAYS * 86400)
+
+
+async def mark_seen(db, search_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Отмечает объявления как увиденные для сохранённого поиска одним bulk_write
+    и возвращает только те, которых раньше не было (т.е. реально новые).
+    """
+    batch: List[Dict[str, Any]] = []
+    ids = set()
+    for item in items:
+        mid = item.get("marketplace_id")
+        if mid and mid not in ids:
+            ids.add(mid)
+            batch.append(item)
+    if not batch:
+        return []
+
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"search_id": search_id, "marketplace_id": item["marketplace_id"]},
+            {"$setOnInsert": {"first_seen": now}, "$set": {"last_seen": now}},
+            upsert=True,
+        )
+        for item in batch
+    ]
+    try:
+        res = await db.seen_listings.bulk_write(ops, ordered=False)
+        inserted = res.upserted_ids.keys()
+    except BulkWriteError as e:
+        # гонка двух сканов одного поиска: дубли ключа не новые, остальное засчитываем
+        inserted = [u["index"] for u in e.details.get("upserted", [])]
+    return [batch[i] for i in sorted(inserted)]
+
+
+async def forget_search(db, search_id: str):
+    await db.seen_listings.delete_many({"search_id": search_id})
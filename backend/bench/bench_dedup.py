@@ -0,0 +1,91 @@
+"""
+Дедупликация на синтетической ленте: заголовки из записанной выдачи, часть объявлений
+перевыложена с новым marketplace_id, «OBO»/«PRICE DROP» и немного другой ценой,
+часть попадает сразу в несколько сохранённых поисков. У перевыложенного превью
+отличается на пару бит dHash (пересжатие), dHash заранее положен в кэш индекса — сеть и Pillow
+не нужны. Показывает, сколько дублей находит индекс, насколько сокращаются выдача и уведомления
+и что вставка в индекс не дорожает с его ростом (LSH).
+
+    cd backend && python bench/bench_dedup.py --listings 20000 --reposts 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.marketplace.dedup import DedupIndex  # noqa: E402
+from app.marketplace.listing import Listing  # noqa: E402
+
+EXPECTED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "marketplace_search.expected.json")
+SUFFIXES = [" - PRICE DROP", " - reduced", " OBO", " (firm)", ""]
+WORDS = ["black", "white", "blue", "red", "silver", "large", "small", "vintage", "modern", "oak", "walnut",
+         "carbon", "steel", "leather", "wireless", "pro", "max", "mini", "kids", "adult", "womens", "mens",
+         "bundle", "set", "pair", "case", "charger", "manual", "original", "box", "extra", "spare"]
+CITIES = ["Austin, TX", "Round Rock, TX", "Cedar Park, TX", "Pflugerville, TX", "Georgetown, TX"]
+
+
+def _unique_title(titles, rng):
+    """Базовый заголовок из выдачи + случайные уточнения, как у разных продавцов."""
+    extra = rng.sample(WORDS, 2) + [f"{rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}{rng.randrange(100, 999)}"]
+    return f"{rng.choice(titles)} {' '.join(extra)}"
+
+
+def feed(n, reposts, rng):
+    """Объявления и dHash их превью (url -> hash)."""
+    with open(EXPECTED, encoding="utf-8") as f:
+        titles = sorted({x["title"].split(" - ")[0] for x in json.load(f)})
+    items, originals, hashes = [], [], {}
+    for i in range(n):
+        mid = str(2000000000000000 + i)
+        image = f"https://scontent.example/{mid}.jpg"
+        if originals and rng.random() < reposts:
+            src = rng.choice(originals)
+            hashes[image] = hashes[src.image_url] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+            items.append(Listing(mid, src.title + rng.choice(SUFFIXES), round(src.price * rng.uniform(0.9, 1.0)),
+                                 src.city, image_url=image))
+            continue
+        hashes[image] = rng.getrandbits(64)
+        item = Listing(mid, _unique_title(titles, rng), float(rng.randrange(10, 900)), rng.choice(CITIES),
+                       image_url=image)
+        originals.append(item)
+        items.append(item)
+    return items, hashes
+
+
+async def main(n, reposts, searches):
+    rng = random.Random(7)
+    items, hashes = feed(n, reposts, rng)
+    index = DedupIndex(max_entries=n * 2)
+    index.images = True
+    index._image_cache.update(hashes)
+
+    t0, step, timings, shown = time.perf_counter(), max(1, n // 4), [], 0
+    for i in range(0, n, step):
+        t = time.perf_counter()
+        shown += len(await index.collapse(items[i:i + step]))
+        timings.append((time.perf_counter() - t) / len(items[i:i + step]) * 1e6)
+    elapsed = time.perf_counter() - t0
+    clusters = index.stats()["clusters"]
+    print(f"index: {n} -> {clusters} clusters ({100 * (1 - clusters / n):.1f}% duplicates, "
+          f"~{round(n * reposts)} reposts generated) in {elapsed:.2f}s; results: {n} -> {shown}")
+    print("us/listing by index quarter: " + " ".join(f"{t:.0f}" for t in timings))
+
+    # одни и те же объявления приходят из нескольких сохранённых поисков (без Mongo — отметки в памяти)
+    notifications = 0
+    for _ in range(searches):
+        notifications += len(await index.claim_notifications(items))
+    print(f"notifications: {n * searches} -> {notifications} across {searches} saved searches")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listings", type=int, default=20000)
+    ap.add_argument("--reposts", type=float, default=0.2)
+    ap.add_argument("--searches", type=int, default=3)
+    args = ap.parse_args()
+    asyncio.run(main(args.listings, args.reposts, args.searches))
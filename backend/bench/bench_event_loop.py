@@ -0,0 +1,83 @@
+"""
+Латентность смешанного трафика на одном воркере: до (sync-скрапер внутри async def)
+и после (async-скрапер). Скрапинг имитируется, чтобы бенчмарк не ходил в сеть:
+"blocking" держит event loop как старый sync Playwright, "async" — отдаёт его.
+
+    cd backend && python bench/bench_event_loop.py --searches 20 --health 200 --scrape 0.5
+
+Нужен httpx (pip install httpx) — в requirements.txt он не входит.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from app.marketplace import pipeline  # noqa: E402
+from app.marketplace.listing import Listing  # noqa: E402
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+
+def _fake_scanner(mode: str, scrape_s: float):
+    async def search(query, filters, timeout=None):
+        if mode == "blocking":
+            time.sleep(scrape_s)
+        else:
+            await asyncio.sleep(scrape_s)
+        return [Listing("1", query, 1.0)]
+    return search
+
+
+async def _run(mode: str, searches: int, health: int, scrape_s: float):
+    pipeline.search_marketplace = _fake_scanner(mode, scrape_s)
+    server.search_cache.clear()
+
+    lat = {"search": [], "health": []}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(kind, delay, n):
+            await asyncio.sleep(delay)
+            t0 = time.perf_counter()
+            if kind == "search":
+                # разные запросы, чтобы кэш поиска не сглаживал картину
+                await client.post("/api/search", json={"query": f"bike {n}"})
+            else:
+                await client.get("/api/health")
+            lat[kind].append(time.perf_counter() - t0)
+
+        span = scrape_s * 2
+        jobs = [one("search", span * i / searches, i) for i in range(searches)]
+        jobs += [one("health", span * i / health, i) for i in range(health)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*jobs)
+        wall = time.perf_counter() - t0
+
+    print(f"{mode:>9}  wall={wall:6.2f}s", end="")
+    for kind in ("search", "health"):
+        v = lat[kind]
+        print(f"  {kind}: p50={_pct(v, .5):8.1f}ms p99={_pct(v, .99):8.1f}ms mean={statistics.mean(v)*1000:8.1f}ms", end="")
+    print()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--searches", type=int, default=20)
+    ap.add_argument("--health", type=int, default=200)
+    ap.add_argument("--scrape", type=float, default=0.5, help="имитируемая длительность скрапинга, с")
+    args = ap.parse_args()
+    for mode in ("blocking", "async"):
+        asyncio.run(_run(mode, args.searches, args.health, args.scrape))
+
+
+if __name__ == "__main__":
+    main()
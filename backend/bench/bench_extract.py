@@ -0,0 +1,70 @@
+"""
+Микро-бенчмарк извлечения карточек: старый цикл query_selector/inner_text по каждой
+карточке против одного eval_on_selector_all. Выдача берётся из сохранённого HTML
+(bench/fixtures/marketplace_search.html) через file://, сеть не нужна.
+
+    cd backend && python bench/bench_extract.py --rounds 20 --cards 30
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.async_api import async_playwright  # noqa: E402
+
+from app.marketplace.pool import LAUNCH_ARGS  # noqa: E402
+from app.marketplace.scanner import CARD_SELECTOR, extract_cards  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "marketplace_search.html")
+
+
+async def legacy_extract(page, max_cards):
+    """Прежняя реализация: 4–5 round trip'ов на карточку."""
+    items = []
+    for card in (await page.query_selector_all(CARD_SELECTOR))[:max_cards]:
+        title_el = await card.query_selector("span, strong")
+        title = (await title_el.inner_text()).strip() if title_el else "Listing"
+        price_el = await card.query_selector("span:has-text('$')")
+        price = 0.0
+        if price_el:
+            raw = (await price_el.inner_text()).replace("$", "").replace(",", "").strip()
+            price = float(raw) if raw and raw.replace(".", "", 1).isdigit() else 0.0
+        link_el = await card.query_selector("a[href*='/marketplace/item/']")
+        href = await link_el.get_attribute("href") if link_el else None
+        img_el = await card.query_selector("img")
+        img = await img_el.get_attribute("src") if img_el else None
+        items.append((title, price, href, img))
+    return items
+
+
+async def _time(label, fn, rounds):
+    await fn()  # прогрев
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        n = len(await fn())
+    per = (time.perf_counter() - t0) / rounds * 1000
+    print(f"{label:>8}: {per:8.2f} ms/page  ({n} cards)")
+    return per
+
+
+async def main(rounds, cards):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        page = await browser.new_page()
+        await page.route("http*://**", lambda route: route.abort())  # картинки из фикстуры не грузим
+        await page.goto("file://" + FIXTURE)
+        old = await _time("legacy", lambda: legacy_extract(page, cards), rounds)
+        new = await _time("bulk", lambda: extract_cards(page, {}, cards), rounds)
+        print(f"speedup: x{old / new:.1f}")
+        await browser.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--cards", type=int, default=30)
+    args = ap.parse_args()
+    asyncio.run(main(args.rounds, args.cards))
@@ -0,0 +1,76 @@
+"""
+Память на большой выдаче: объявления-словари + ответ целиком через jsonable_encoder/json.dumps
+против Listing (__slots__) + потоковой сериализации iter_json. Браузер и сеть не нужны.
+
+    cd backend && python bench/bench_memory.py --listings 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.jsonenc import iter_json, orjson  # noqa: E402
+from app.marketplace.listing import Listing  # noqa: E402
+
+try:
+    from fastapi.encoders import jsonable_encoder  # так сериализует FastAPI, если вернуть dict
+except ImportError:
+    def jsonable_encoder(obj):
+        return json.loads(json.dumps(obj))   # такие же полные копии, как у jsonable_encoder
+
+
+def _row(i):
+    mid = str(1000000000000000 + i)
+    return (mid, f"Listing number {i} - like new, pickup only", float(i % 900), "Austin, TX", "Miscellaneous",
+            f"https://scontent.example/v/t45/{mid}_n.jpg", f"https://m.facebook.com/marketplace/item/{mid}/",
+            "2024-05-01T12:00:00", "Any")
+
+
+def _as_dict(row):
+    return dict(zip(("marketplace_id", "title", "price", "city", "category", "image_url", "url",
+                     "published_at", "condition"), row))
+
+
+def legacy(n):
+    items = [_as_dict(_row(i)) for i in range(n)]
+    built = tracemalloc.get_traced_memory()[0]
+    body = json.dumps(jsonable_encoder({"listings": items, "total": len(items), "query": "bench"}),
+                      ensure_ascii=False).encode("utf-8")
+    return built, len(body)
+
+
+def lean(n):
+    items = [Listing(*_row(i)) for i in range(n)]
+    built = tracemalloc.get_traced_memory()[0]
+    size = sum(len(chunk) for chunk in iter_json("listings", items, total=len(items), query="bench"))
+    return built, size
+
+
+def measure(label, fn, n):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    built, size = fn(n)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:>7}: records {built / 2**20:7.1f} MB  peak {peak / 2**20:7.1f} MB  "
+          f"{elapsed * 1000:7.0f} ms  body {size / 2**20:.1f} MB")
+    return built, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listings", type=int, default=20000)
+    n = ap.parse_args().listings
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}")
+    old_built, old_peak = measure("legacy", legacy, n)
+    new_built, new_peak = measure("lean", lean, n)
+    print(f"records x{old_built / new_built:.1f} smaller, peak x{old_peak / new_peak:.1f} smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Пропускная способность уведомлений против локальных заглушек SMTP и Pushover (сеть не нужна):
+  - legacy: новое SMTP-соединение + login на каждое письмо, requests.post без Session;
+  - session: одно SMTP-соединение и общий requests.Session;
+  - digest: NotificationDispatcher группирует объявления в одно сообщение на окно.
+
+    cd backend && python bench/bench_notify.py --messages 200
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SMTPStandIn:
+    """Минимальный SMTP-сервер: EHLO/AUTH/MAIL/RCPT/DATA/QUIT, письма только считает."""
+
+    def __init__(self):
+        self.messages = 0
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 standin ESMTP\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            cmd = line.decode(errors="ignore").strip().upper()
+            if cmd.startswith("EHLO"):
+                writer.write(b"250-standin\r\n250 AUTH PLAIN LOGIN\r\n")
+            elif cmd.startswith("AUTH"):
+                writer.write(b"235 ok\r\n")
+            elif cmd == "DATA":
+                writer.write(b"354 go\r\n")
+                await writer.drain()
+                while (await reader.readline()) not in (b".\r\n", b""):
+                    pass
+                self.messages += 1
+                writer.write(b"250 queued\r\n")
+            elif cmd == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+
+class _PushHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, иначе Session не переиспользует соединение
+    hits = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        _PushHandler.hits += 1
+        body = b'{"status":1}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _legacy_email(i):
+    msg = MIMEText(f"body {i}")
+    msg["Subject"], msg["From"], msg["To"] = "x", "bench@local", "to@local"
+    with smtplib.SMTP(os.environ["SMTP_HOST"], int(os.environ["SMTP_PORT"])) as s:
+        s.login("bench@local", "x")
+        s.sendmail("bench@local", ["to@local"], msg.as_string())
+
+
+def _legacy_push(i):
+    import requests
+    requests.post(os.environ["PUSHOVER_URL"], data={"message": str(i)}, timeout=10)
+
+
+def _rate(label, n, seconds):
+    print(f"{label:>16}: {n / seconds:8.1f} msg/s  ({n} in {seconds:.2f}s)")
+
+
+async def main(n):
+    smtp = SMTPStandIn()
+    server = await asyncio.start_server(smtp.handle, "127.0.0.1", 0)
+    http = ThreadingHTTPServer(("127.0.0.1", 0), _PushHandler)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(server.sockets[0].getsockname()[1]),
+        "SMTP_USER": "bench@local", "SMTP_PASS": "x", "SMTP_STARTTLS": "0",
+        "PUSHOVER_USER": "u", "PUSHOVER_TOKEN": "t",
+        "PUSHOVER_URL": f"http://127.0.0.1:{http.server_address[1]}/1/messages.json",
+        "NOTIFY_DIGEST_SECONDS": "0.2", "NOTIFY_BACKOFF": "0.05",
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.notifications.emailer import send_email, smtp_session
+    from app.notifications.pushover import send_push
+    from app.notifications.dispatcher import NotificationDispatcher
+
+    async def timed(label, fn):
+        t0 = time.perf_counter()
+        await asyncio.gather(*(asyncio.to_thread(fn, i) for i in range(n)))
+        _rate(label, n, time.perf_counter() - t0)
+
+    await timed("legacy email", _legacy_email)
+    await timed("session email", lambda i: send_email("to@local", "x", f"body {i}"))
+    await timed("legacy push", _legacy_push)
+    await timed("session push", lambda i: send_push("t", str(i)))
+    print(f"SMTP connections: legacy+session = {smtp.connections}, session reconnects = {smtp_session.connects}")
+
+    d = NotificationDispatcher(workers=2)
+    await d.start()
+    t0 = time.perf_counter()
+    for i in range(n):
+        d.notify_listings("to@local", "bench", [{"title": f"item {i}", "price": i, "url": f"http://x/{i}"}])
+    await d.stop()
+    st = d.stats()
+    print(f"{'digest':>16}: {st['listings']} listings -> {st['messages']} messages "
+          f"(sent={st['sent']}, failed={st['failed']}) in {time.perf_counter() - t0:.2f}s")
+
+    server.close()
+    http.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200)
+    asyncio.run(main(ap.parse_args().messages))
@@ -0,0 +1,276 @@
+"""
+Сквозной офлайн-бенчмарк скрапера: локальный HTTP-сервер отдаёт записанную выдачу
+(bench/fixtures/marketplace_search.html), FB_BASE/MARKETPLACE_SEARCH указывают на него,
+search_marketplace гоняется с заданной параллельностью через настоящий пул браузеров.
+
+Печатает pages/sec, латентность стадий (launch/context/goto/wait/extract), пиковый RSS
+(процесс + Chromium) и сверяет результат с bench/fixtures/marketplace_search.expected.json.
+Сравнивает с базовой линией (bench/baseline.json) и завершается с кодом 1 при регрессии,
+расхождении с фикстурой или отсутствии базовой линии — сама она не создаётся, её пишет
+только явный --update-baseline по корректному прогону.
+
+Фикстура в репозитории пока синтетическая (разметка собрана вручную по образцу m.facebook.com).
+--record снимает настоящую выдачу: открывает URL через пул с сессией FB (/tmp/fb_context.json),
+сохраняет DOM без <script> в фикстуру и expected.json — то, что из него извлёк сканер.
+Порядок на машине с Chromium и живой сессией: --record, затем --update-baseline (он же
+проверит, что офлайн-копия даёт ту же выдачу), затем коммит фикстуры и bench/baseline.json.
+
+    cd backend && python bench/bench_scanner.py --searches 40 --concurrency 4 --pool 2
+    cd backend && python bench/bench_scanner.py --record "https://m.facebook.com/marketplace/austin/search/?query=bike"
+    cd backend && python bench/bench_scanner.py --update-baseline   # записать новую базовую линию
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(BENCH_DIR, "fixtures")
+PAGE = os.path.join(FIXTURES, "marketplace_search.html")
+EXPECTED = os.path.join(FIXTURES, "marketplace_search.expected.json")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+STAGES = ("launch", "context", "goto", "wait", "extract")
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    """/marketplace/?query=... -> записанная выдача; остальное — файлы из fixtures/ или 404."""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES, **kwargs)
+
+    def translate_path(self, path):
+        if path.split("?", 1)[0].rstrip("/") == "/marketplace":
+            return PAGE
+        return super().translate_path(path)
+
+    def log_message(self, *args):
+        pass
+
+
+class RSSSampler:
+    """Пиковый суммарный RSS процесса и его потомков (драйвер Playwright, Chromium) по /proc."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, _tree_rss_kb(os.getpid()))
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak_kb / 1024, 1)
+
+
+def _tree_rss_kb(root: int) -> int:
+    if not os.path.isdir("/proc"):
+        return 0
+    parents, rss = {}, {}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+            parents[int(pid)] = int(fields["PPid"])
+            rss[int(pid)] = int(fields.get("VmRSS", "0 kB").split()[0])
+        except (OSError, KeyError, ValueError):
+            continue
+    tree, frontier = {root}, [root]
+    while frontier:
+        parent = frontier.pop()
+        for pid, ppid in parents.items():
+            if ppid == parent and pid not in tree:
+                tree.add(pid)
+                frontier.append(pid)
+    return sum(rss.get(pid, 0) for pid in tree)
+
+
+def _check(items, expected):
+    """Ошибки сравнения с записанным результатом (пустой список — всё совпало)."""
+    got = [(x["marketplace_id"], x["title"], x["price"], x["city"]) for x in items]
+    want = [(x["marketplace_id"], x["title"], x["price"], x["city"]) for x in expected]
+    if got == want:
+        return []
+    errors = [f"expected {len(want)} cards, got {len(got)}"] if len(got) != len(want) else []
+    errors += [f"card {i}: {g} != {w}" for i, (g, w) in enumerate(zip(got, want)) if g != w]
+    return errors[:5]
+
+
+def _regressions(result, baseline, tolerance):
+    out = []
+    if result["pages_per_sec"] < baseline["pages_per_sec"] * (1 - tolerance):
+        out.append(f"pages/sec {result['pages_per_sec']} < baseline {baseline['pages_per_sec']}")
+    for stage, base in baseline.get("stages", {}).items():
+        cur = result["stages"].get(stage)
+        # +5 мс абсолютного запаса: у быстрых стадий относительный шум большой
+        if cur and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance) + 5:
+            out.append(f"{stage} p95 {cur['p95_ms']}ms > baseline {base['p95_ms']}ms")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        out.append(f"peak RSS {result['peak_rss_mb']}MB > baseline {baseline['peak_rss_mb']}MB")
+    return out
+
+
+_SCRIPT_RE = re.compile(r"<script\b.*?</script>", re.S | re.I)
+
+
+async def record(url: str, max_cards: int):
+    """Настоящая выдача -> фикстура + expected.json. Нужны Chromium и сессия FB."""
+    from app.marketplace.scanner import CARD_SELECTOR, browser_pool, extract_cards, is_blocked
+    from app.marketplace.session import DEFAULT_ACCOUNT, session_pool
+
+    await session_pool.load()
+    pool = browser_pool()
+    try:
+        async with pool.context(DEFAULT_ACCOUNT if session_pool.has_session() else None) as context:
+            page = await context.new_page()
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            if is_blocked(page.url):
+                raise SystemExit(f"record: redirected to {page.url}; log in first (POST /api/auth/facebook/login)")
+            await page.wait_for_selector(CARD_SELECTOR, timeout=15000)
+            items = await extract_cards(page, {}, max_cards)
+            html = await page.content()
+            await page.close()
+    finally:
+        await pool.close()
+    if not items:
+        raise SystemExit("record: no cards on the page, fixture not written")
+
+    # скрипты выдачи в офлайне всё равно не заработают, а с ними страница лезла бы в сеть
+    with open(PAGE, "w", encoding="utf-8") as f:
+        f.write(_SCRIPT_RE.sub("", html))
+    with open(EXPECTED, "w", encoding="utf-8") as f:
+        json.dump([{k: x[k] for k in ("marketplace_id", "title", "price", "city")} for x in items],
+                  f, indent=1, ensure_ascii=False)
+        f.write("\n")
+    print(f"recorded {len(items)} cards from {url} -> {PAGE}")
+
+
+async def run(searches: int, concurrency: int, max_cards: int):
+    from app.core.timing import stage_timings
+    from app.marketplace.scanner import browser_pool, search_marketplace
+
+    with open(EXPECTED, encoding="utf-8") as f:
+        expected = json.load(f)[:max_cards]
+
+    with RSSSampler() as rss:
+        t0 = time.perf_counter()
+        await browser_pool().start()
+        sem = asyncio.Semaphore(concurrency)
+        failures = []
+
+        async def one(i):
+            async with sem:
+                items = await search_marketplace(f"bench {i}", {}, max_cards=max_cards)
+                failures.extend(_check(items, expected))
+
+        t1 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(searches)))
+        wall = time.perf_counter() - t1
+        startup = t1 - t0
+        await browser_pool().close()
+
+    return {
+        "searches": searches,
+        "concurrency": concurrency,
+        "pool": browser_pool().size,
+        "startup_s": round(startup, 2),
+        "wall_s": round(wall, 2),
+        "pages_per_sec": round(searches / wall, 2),
+        "stages": {k: v for k, v in stage_timings.snapshot().items() if k in STAGES},
+        "peak_rss_mb": rss.peak_mb,
+        "correct": not failures,
+        "failures": failures[:5],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--searches", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--pool", type=int, default=2, help="BROWSER_POOL_SIZE")
+    ap.add_argument("--cards", type=int, default=30)
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение, доля")
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--record", metavar="URL", help="снять настоящую выдачу в фикстуру (нужна сессия FB)")
+    args = ap.parse_args()
+
+    if args.record:
+        sys.path.insert(0, os.path.dirname(BENCH_DIR))
+        asyncio.run(record(args.record, args.cards))
+        return
+
+    http = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{http.server_address[1]}"
+
+    # до импорта app.*: константы сканера и пула читаются из окружения при импорте
+    os.environ.update({
+        "FB_BASE": base,
+        "MARKETPLACE_SEARCH": base + "/marketplace/?query={q}",
+        "BROWSER_POOL_SIZE": str(args.pool),
+        "BROWSER_POOL_QUEUE": str(max(16, args.concurrency)),
+    })
+    for var in ("FB_EMAIL", "FB_PASSWORD"):
+        os.environ.pop(var, None)   # без логина: иначе каждый поиск пытался бы войти
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+    result = asyncio.run(run(args.searches, args.concurrency, args.cards))
+    http.shutdown()
+
+    print(f"pages/sec: {result['pages_per_sec']}  ({result['searches']} searches, concurrency "
+          f"{result['concurrency']}, pool {result['pool']}, wall {result['wall_s']}s, startup {result['startup_s']}s)")
+    for stage in STAGES:
+        s = result["stages"].get(stage)
+        if s:
+            print(f"{stage:>8}: n={s['count']:<4} p50={s['p50_ms']:8.1f}ms p95={s['p95_ms']:8.1f}ms max={s['max_ms']:8.1f}ms")
+    print(f"peak RSS: {result['peak_rss_mb']} MB")
+    print("correct: yes" if result["correct"] else "correct: NO\n  " + "\n  ".join(result["failures"]))
+
+    if args.update_baseline:
+        if not result["correct"]:
+            print("baseline NOT written: results differ from recorded fixture")
+            sys.exit(1)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: result[k] for k in ("searches", "concurrency", "pool", "pages_per_sec",
+                                              "stages", "peak_rss_mb")}, f, indent=1)
+            f.write("\n")
+        print(f"baseline written: {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        # без базовой линии сравнивать не с чем — это не «зелёный» прогон
+        print(f"REGRESSION: no baseline at {args.baseline}; record one with --update-baseline")
+        sys.exit(1)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = _regressions(result, baseline, args.tolerance)
+    if not result["correct"]:
+        problems.insert(0, "results differ from recorded fixture")
+    for p in problems:
+        print(f"REGRESSION: {p}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Холодный старт API: время `import server` в свежем интерпретаторе (медиана по --runs),
+самые дорогие модули по `python -X importtime` и список тяжёлых подсистем, которые
+при импорте загружаться не должны (Playwright, motor/pymongo, APScheduler, requests).
+С --serve дополнительно поднимает uvicorn и меряет время до первого ответа /api/health.
+
+Завершается с кодом 1, если медиана импорта больше --budget-ms или тяжёлый модуль
+загрузился при импорте.
+
+    cd backend && python bench/bench_startup.py --runs 5 --budget-ms 600
+    cd backend && python bench/bench_startup.py --serve
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("playwright", "motor", "pymongo", "apscheduler", "requests")
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import server
+elapsed = time.perf_counter() - t0
+heavy = sorted({m.split(".")[0] for m in sys.modules if m.split(".")[0] in %r})
+print(json.dumps({"ms": elapsed * 1000, "heavy": heavy}))
+""" % (HEAVY,)
+
+
+def _import_once(env):
+    out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=BACKEND, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _importtime_top(env, top):
+    """Самые дорогие пакеты (cumulative, мс) по выводу -X importtime; сам server не считается."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=BACKEND, env=env,
+                         capture_output=True, text=True, check=True)
+    cost = {}
+    for line in out.stderr.splitlines():
+        parts = line.split(":", 1)[-1].split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue  # строка-заголовок
+        root = parts[2].strip().split(".")[0]
+        if root != "server":
+            cost[root] = max(cost.get(root, 0), cumulative)
+    return sorted(((n, us / 1000) for n, us in cost.items()), key=lambda x: -x[1])[:top]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _time_to_health(env, timeout=60.0):
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND, env=env)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as r:
+                    if r.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=600, help="бюджет на медиану `import server`")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--serve", action="store_true", help="ещё и время до первого /api/health под uvicorn")
+    ap.add_argument("--no-scanner", action="store_true", help="SCANNER_ENABLED=0")
+    args = ap.parse_args()
+
+    env = {**os.environ, "SCANNER_ENABLED": "0" if args.no_scanner else os.getenv("SCANNER_ENABLED", "1")}
+    _import_once(env)  # прогрев: .pyc и файловый кэш ОС
+    runs = [_import_once(env) for _ in range(args.runs)]
+    median = statistics.median(r["ms"] for r in runs)
+    heavy = sorted({m for r in runs for m in r["heavy"]})
+
+    print(f"import server: median {median:.0f} ms, min {min(r['ms'] for r in runs):.0f} ms "
+          f"({args.runs} runs, budget {args.budget_ms:.0f} ms)")
+    print("top packages (cumulative):")
+    for name, ms in _importtime_top(env, args.top):
+        print(f"  {name:<24} {ms:8.1f} ms")
+    print(f"heavy modules at import: {', '.join(heavy) or 'none'}")
+
+    if args.serve:
+        ms = _time_to_health(env)
+        print(f"uvicorn -> first /api/health: {'timeout' if ms is None else f'{ms:.0f} ms'}")
+
+    problems = []
+    if median > args.budget_ms:
+        problems.append(f"import {median:.0f} ms > budget {args.budget_ms:.0f} ms")
+    if heavy:
+        problems.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    for p in problems:
+        print(f"REGRESSION: {p}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
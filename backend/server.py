@@ -1,24 +1,29 @@
 import os
-import json
+import asyncio
+import sys
+import time
+from functools import partial
 from datetime import datetime
-from typing import Any, Dict, List, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from app.core.models import SearchRequest, AuthStatus
-from app.marketplace.scanner import search_marketplace, has_session, ensure_session_login
-from app.notifications.emailer import send_email
-from app.notifications.pushover import push
-
-load_dotenv()
-MONGO_URL = os.getenv("MONGO_URL")
-PORT = int(os.getenv("PORT", "8001"))
-
-SESSION_FILE = "/tmp/fb_context.json"   # файл для Playwright
+# Здесь только лёгкие модули. Playwright (сканер), motor, APScheduler, requests (уведомления)
+# импортируются при первом использовании — см. _scanner(), _bootstrap(), bench/bench_startup.py
+from app.core.models import ALERT_MODES, SearchRequest, AuthStatus
+from app.core.jsonenc import dumps, iter_json
+from app.core.metrics import registry
+from app.core.timing import span, start_trace, server_timing
+from app.marketplace.lean import lean_stats
+from app.marketplace.session import DEFAULT_ACCOUNT, session_pool, valid_account_name
+from app.marketplace.cache import search_cache
+from app.marketplace.dedup import dedup_index
+from app.marketplace.filters import sort_listings
+from app.marketplace.geo import geocode
+from app.storage.mongo import connect
 
 # -----------------------------------------------------------------------------
 # Env & app setup
@@ -26,6 +31,10 @@ SESSION_FILE = "/tmp/fb_context.json"   # файл для Playwright
 load_dotenv()
 MONGO_URL = os.getenv("MONGO_URL")
 PORT = int(os.getenv("PORT", "8001"))
+# 0 — API без скрапинга: Playwright не загружается, поиск отвечает 503, сохранённые объявления доступны
+SCANNER_ENABLED = os.getenv("SCANNER_ENABLED", "1") == "1"
+# 0 — API не сканирует сохранённые поиски сам, это делают отдельные `python worker.py`
+SCAN_IN_API = SCANNER_ENABLED and os.getenv("SCAN_IN_API", "1") == "1"
 
 app = FastAPI(title="Marketplace Finder API")
 app.add_middleware(
@@ -36,52 +45,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = AsyncIOMotorClient(MONGO_URL) if MONGO_URL else None
-db = client.mpf if client else None
-# === restore from DB helper ===
-async def restore_session_from_db() -> bool:
-    """
-    Если /tmp/fb_context.json нет — пытается достать storage_state из Mongo
-    (коллекция sessions, документ _id="fb_storage_state") и записать файл.
-    """
-    if os.path.exists(SESSION_FILE):
-        return True
-    # В Motor/PyMongo нельзя писать if not db — только явное сравнение:
-    if db is None:
-        return False
+# -----------------------------------------------------------------------------
+# Метрики запросов; с заголовком `X-Trace: 1` ответ несёт Server-Timing по стадиям
+# -----------------------------------------------------------------------------
+http_seconds = registry.histogram("mpf_http_request_seconds", "HTTP request latency", ["route", "method", "status"])
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    trace = start_trace() if request.headers.get("x-trace") else None
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    if trace is not None:
+        # заголовок уходит до тела: total здесь — время до первого байта
+        response.headers["Server-Timing"] = server_timing(trace + [("total", elapsed)])
+    response.body_iterator = _timed_body(response.body_iterator, started, route, request.method, response.status_code)
+    return response
+
+
+async def _timed_body(body, started: float, route: str, method: str, status: int):
+    """Латентность — до последнего куска тела: поиск, /api/listings и NDJSON-поток отдаются StreamingResponse."""
     try:
-        doc = await db.sessions.find_one({"_id": "fb_storage_state"})
-        if not doc or "storage_state" not in doc:
-            return False
-        os.makedirs(os.path.dirname(SESSION_FILE), exist_ok=True)
-        with open(SESSION_FILE, "w", encoding="utf-8") as f:
-            json.dump(doc["storage_state"], f, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print("restore_session_from_db error:", e)
-        return False
+        async for chunk in body:
+            yield chunk
+    finally:
+        http_seconds.observe(time.perf_counter() - started, route=route, method=method, status=status)
+
+db = connect(MONGO_URL)   # motor импортируется и клиент создаётся при первом запросе к базе
+
+scheduler = None            # APScheduler и ScanScheduler — только если этот процесс сканирует (SCAN_IN_API)
+scan_scheduler = None
+scan_worker: Optional[asyncio.Task] = None
+bootstrap: Optional[asyncio.Task] = None
+storage_ready = asyncio.Event()   # индексы Mongo созданы; браузеры и прогрев цен могут ещё идти
+
+
+def _loaded(module: str):
+    """Модуль ленивой подсистемы, если она уже загружена, иначе None (статистика не тянет импорт)."""
+    return sys.modules.get(module)
+
+
+def _loaded_stats(module: str, get: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+    mod = _loaded(module)
+    return get(mod) if mod is not None else {}
 
- 
 
+async def _until_ready():
+    if bootstrap is not None:
+        await asyncio.shield(bootstrap)
 
-scheduler = AsyncIOScheduler()
+
+async def _until_storage_ready():
+    """Для запросов только к Mongo: ждать индексы, но не запуск Chromium."""
+    if bootstrap is not None:
+        await storage_ready.wait()
+
+
+async def _scanner():
+    """Модуль сканера: Playwright и пул браузеров грузятся при первом поиске, а не при старте API."""
+    if not SCANNER_ENABLED:
+        raise HTTPException(503, "Scanner is disabled on this instance (SCANNER_ENABLED=0)")
+    await _until_ready()
+    from app.marketplace import scanner
+    return scanner
 
 # -----------------------------------------------------------------------------
-# Lifecycle
+# Lifecycle: всё тяжёлое — в фоне, /api/health отвечает сразу после импорта
 # -----------------------------------------------------------------------------
 @app.on_event("startup")
 async def on_start():
+    global bootstrap
+    bootstrap = asyncio.create_task(_bootstrap())
+
+async def _bootstrap():
     try:
+        try:
+            await search_cache.attach_db(db)
+            await dedup_index.attach_db(db)
+            if db is not None:
+                try:
+                    from app.storage.listings import ensure_listing_indexes
+                    from app.storage.seen import ensure_seen_indexes
+                    await ensure_seen_indexes(db)
+                    await ensure_listing_indexes(db)
+                except Exception as e:
+                    print(f"[indexes error] {e}")
+                from app.marketplace.prices import price_tracker
+                await price_tracker.attach_db(db, warm=False)
+        finally:
+            storage_ready.set()   # /api/listings и история цен дальше не ждут
+        # storage_state держим в памяти; Mongo (иначе файл) читаем здесь, дальше — только смену версии
+        await session_pool.load(db)
+        session_pool.start_watch()
+        if db is not None:
+            from app.marketplace.prices import price_tracker
+            await price_tracker.warm()   # последние цены — в память до первого скана
+        if SCANNER_ENABLED:
+            await _start_scanner()
+    except Exception as e:
+        print(f"[startup error] {e}")
+
+async def _start_scanner():
+    global scheduler, scan_scheduler, scan_worker
+    from app.marketplace.enrich import detail_enricher
+    from app.marketplace.scanner import browser_pool
+    from app.notifications.dispatcher import dispatcher
+
+    await detail_enricher.attach_db(db)
+    await dispatcher.start()
+    if SCAN_IN_API and db is not None:
+        # producer (лидер среди реплик) ставит задачи в scan_jobs, воркеры (здесь и/или worker.py) их разбирают
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        from app.marketplace.pipeline import scan_group
+        from app.marketplace.scan_scheduler import ScanScheduler, SCAN_TICK_SECONDS
+
+        scan_scheduler = ScanScheduler(partial(scan_group, db), saturated=lambda: browser_pool().saturated())
+        try:
+            await scan_scheduler.attach_db(db)
+        except Exception as e:
+            print(f"[indexes error] {e}")
+        scheduler = AsyncIOScheduler()
+        scheduler.add_job(scan_scheduler.tick, "interval", args=[db], seconds=SCAN_TICK_SECONDS,
+                          max_instances=1, coalesce=True)
         scheduler.start()
-    except Exception:
-        pass
+        scan_worker = asyncio.create_task(scan_scheduler.run_worker(db))
+    try:
+        await browser_pool().start()   # прогреваем браузеры заранее
+    except Exception as e:
+        print(f"[POOL start error] {e}")
+
+@app.on_event("shutdown")
+async def on_stop():
+    if bootstrap is not None and not bootstrap.done():
+        bootstrap.cancel()
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    if scan_worker is not None:
+        await scan_scheduler.stop()
+        scan_worker.cancel()
+    scanner = _loaded("app.marketplace.scanner")
+    if scanner is not None:
+        try:
+            await scanner.browser_pool().close()
+        except Exception:
+            pass
+    notifications = _loaded("app.notifications.dispatcher")
+    if notifications is not None:
+        await notifications.dispatcher.stop()
+    session_pool.stop_watch()
+    try:
+        await session_pool.flush()
+    except Exception as e:
+        print(f"[session persist error] {e}")
 
 # -----------------------------------------------------------------------------
 # Health
 # -----------------------------------------------------------------------------
 @app.get("/api/health")
 async def health():
-    return {"ok": True, "time": datetime.utcnow().isoformat()}
+    return {"ok": True, "time": datetime.utcnow().isoformat(),
+            "ready": bootstrap is not None and bootstrap.done()}
 @app.get("/api/db/ping")
 async def db_ping():
     if db is None:
@@ -99,8 +223,9 @@ async def db_ping():
 @app.api_route("/api/auth/facebook/login", methods=["GET", "POST"])
 async def fb_login(request: Request):
     ok = False
+    scanner = await _scanner()   # SCANNER_ENABLED=0 -> 503
     try:
-        ok = ensure_session_login()
+        ok = await scanner.ensure_session_login(force=True)
     except Exception as e:
         print(f"[fb_login ERROR] {e}")
     if not ok:
@@ -112,12 +237,11 @@ async def fb_login(request: Request):
 
 @app.get("/api/auth/facebook/status", response_model=AuthStatus)
 async def fb_status():
-    # Если файл сессии исчез (после рестарта), пробуем восстановить его из MongoDB
-    if not has_session():
-        await restore_session_from_db()
+    # Сессия в памяти (загружена из файла/MongoDB на старте) — без I/O на запрос
+    ok = session_pool.has_session()
     return AuthStatus(
-        authenticated=has_session(),
-        message=("Logged in (session found)" if has_session()
+        authenticated=ok,
+        message=("Logged in (session found)" if ok
                  else "Not authenticated. Upload cookies or run login.")
     )
 
@@ -180,70 +304,12 @@ def _normalize_cookies_to_storage_state(raw: Union[List[Dict[str, Any]], Dict[st
 
     return {"cookies": cookies_out, "origins": []}
 
-from fastapi import Request
-
-from fastapi import Request
-from typing import Union, List, Dict, Any
-
-def _normalize_cookies_to_storage_state(raw: Union[List[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
-    """
-    Принимает либо список cookie-объектов, либо {"cookies":[...]}.
-    Возвращает storage_state формата Playwright: {"cookies":[...], "origins":[]}
-    """
-    if isinstance(raw, dict) and "cookies" in raw and isinstance(raw["cookies"], list):
-        cookies_in = raw["cookies"]
-    elif isinstance(raw, list):
-        cookies_in = raw
-    else:
-        raise ValueError("Invalid cookies payload; expected list or {'cookies': [...]}")
-
-    cookies_out = []
-    for c in cookies_in:
-        try:
-            name = c.get("name") or c.get("Name") or c.get("key")
-            value = c.get("value") or c.get("Value")
-            domain = c.get("domain") or c.get("Domain")
-            path = c.get("path") or c.get("Path") or "/"
-            httpOnly = bool(c.get("httpOnly") or c.get("HttpOnly") or c.get("http_only") or False)
-            secure = bool(c.get("secure") or c.get("Secure") or False)
-            sameSite = c.get("sameSite") or c.get("SameSite") or "Lax"
-            expires = c.get("expires") or c.get("expirationDate")
-
-            if not (name and value and domain):
-                continue
-
-            samesite_map = {"lax": "Lax", "strict": "Strict", "none": "None"}
-            ss = samesite_map.get(str(sameSite).lower(), "Lax")
-
-            cookie = {
-                "name": name,
-                "value": value,
-                "domain": domain,
-                "path": path,
-                "httpOnly": httpOnly,
-                "secure": secure,
-                "sameSite": ss,
-            }
-            if expires is not None:
-                try:
-                    cookie["expires"] = int(expires)
-                except Exception:
-                    pass
-
-            cookies_out.append(cookie)
-        except Exception:
-            continue
-
-    return {"cookies": cookies_out, "origins": []}
-
-from fastapi import Request
-from fastapi.responses import JSONResponse
-
 @app.post("/api/auth/facebook/cookies")
-async def upload_cookies(req: Request):
+async def upload_cookies(req: Request, name: Optional[str] = None):
     """
-    Принимает либо массив cookie-объектов, либо объект {"cookies":[...]}.
-    Сохраняет в Mongo (sessions/_id=fb_storage_state) и файл /tmp/fb_context.json.
+    Принимает либо массив cookie-объектов, либо объект {"cookies":[...], "name": "..."}.
+    name (в теле или ?name=) — аккаунт в пуле сессий; по умолчанию "default".
+    Сохраняет в Mongo (sessions/_id=fb_storage_state[:name]), файл /tmp/fb_context[.name].json и память процесса.
     """
     try:
         payload = await req.json()
@@ -254,6 +320,14 @@ async def upload_cookies(req: Request):
         )
 
     # Нормализуем вход
+    if isinstance(payload, dict) and payload.get("name"):
+        name = str(payload["name"])
+    name = name or DEFAULT_ACCOUNT
+    if not valid_account_name(name):
+        return JSONResponse(
+            {"authenticated": False, "saved": False, "error": "Invalid session name (A-Z, 0-9, _ . -, up to 64)"},
+            status_code=400,
+        )
     if isinstance(payload, list):
         storage_state = {"cookies": payload}
     elif isinstance(payload, dict) and "cookies" in payload and isinstance(payload["cookies"], list):
@@ -272,21 +346,15 @@ async def upload_cookies(req: Request):
         )
 
     try:
-        # Сохраняем cookies в MongoDB (upsert)
-        await db.sessions.update_one(
-            {"_id": "fb_storage_state"},
-            {"$set": {"_id": "fb_storage_state", "storage_state": storage_state}},
-            upsert=True,
-        )
-
-        # Создаём локальный файл /tmp/fb_context.json
-        os.makedirs(os.path.dirname(SESSION_FILE), exist_ok=True)
-        with open(SESSION_FILE, "w", encoding="utf-8") as f:
-            json.dump(storage_state, f, ensure_ascii=False)
-
-        # Пробуем активировать сессию
-        ok = ensure_session_login()
-        return {"authenticated": bool(ok), "saved": True, "cookies": len(storage_state.get("cookies", []))}
+        # Память + MongoDB (upsert) + /tmp/fb_context.json; контексты браузеров пересоздадутся
+        await session_pool.get(name).set_state(storage_state)
+
+        # Пробуем активировать сессию (логин через браузер — только если сканер включён)
+        ok = session_pool.has_session()
+        if not ok and SCANNER_ENABLED:
+            ok = await (await _scanner()).ensure_session_login()
+        return {"authenticated": bool(ok), "saved": True, "name": name,
+                "cookies": len(storage_state.get("cookies", []))}
     except Exception as e:
         return JSONResponse(
             {"authenticated": False, "saved": False, "error": str(e)},
@@ -295,24 +363,39 @@ async def upload_cookies(req: Request):
 
 
 @app.post("/api/auth/facebook/clear")
-async def fb_clear_session():
+async def fb_clear_session(name: str = DEFAULT_ACCOUNT):
     try:
-        if os.path.exists(SESSION_FILE):
-            os.remove(SESSION_FILE)
+        if name in session_pool.accounts:
+            await session_pool.get(name).clear()
         return {"ok": True, "message": "Session cleared."}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
+@app.get("/api/admin/sessions")
+async def admin_sessions():
+    """Пул аккаунтов: наличие сессии, лимит (tokens), cooldown после checkpoint, счётчики."""
+    return {"sessions": session_pool.snapshot()}
+
 # -----------------------------------------------------------------------------
 # Search (never throws 500)
 # -----------------------------------------------------------------------------
 @app.post("/api/search")
 async def api_search(payload: SearchRequest):
-    # Если файл сессии исчез, восстановим из Mongo перед поиском
-    await restore_session_from_db()
+    await _scanner()   # вне try: SCANNER_ENABLED=0 -> 503, а не 200 с ошибкой
     try:
-        items = search_marketplace(payload.query or "", payload.model_dump())
-        return {"listings": items, "total": len(items), "query": payload.query or ""}
+        from app.marketplace.pipeline import enrich_and_store, scrape_and_store
+        filters = payload.model_dump()
+        items = await search_cache.get_or_fetch(
+            payload.query, filters,
+            lambda: scrape_and_store(db, payload.query or "", filters, timeout=payload.timeout),
+        )
+        if payload.enrich:
+            # кэш поиска хранит карточки выдачи; страницы объявлений кэшируются отдельно по marketplace_id
+            items = await enrich_and_store(db, items, filters)
+        items = sort_listings(items, payload.sort_by, payload.limit)
+        # объявления кодируются кусками прямо в ответ, без jsonable_encoder и копий словарей
+        return StreamingResponse(iter_json("listings", items, total=len(items), query=payload.query or ""),
+                                 media_type="application/json")
     except Exception as e:
         return {
             "listings": [],
@@ -322,6 +405,113 @@ async def api_search(payload: SearchRequest):
         }
 
 
+@app.post("/api/search/stream")
+async def api_search_stream(payload: SearchRequest):
+    """
+    NDJSON: по строке на объявление по мере прокрутки выдачи,
+    последняя строка — {"done": true, "total": N, "query": ...}.
+    """
+    scanner = await _scanner()
+    from app.marketplace.pipeline import store_listings
+    filters = payload.model_dump()
+    kwargs = {}
+    if payload.limit:
+        kwargs["target"] = payload.limit
+    if payload.timeout:
+        kwargs["time_budget"] = payload.timeout
+
+    async def lines():
+        total, error, batch = 0, None, []
+        items = scanner.iter_marketplace(payload.query or "", filters, **kwargs)
+        try:
+            async for item in items:
+                total += 1
+                batch.append(item)
+                if len(batch) >= 100:
+                    await store_listings(db, batch)
+                    batch = []
+                yield dumps(item) + b"\n"
+        except Exception as e:
+            error = str(e)
+            print(f"[SEARCH STREAM ERROR] {e}")
+        finally:
+            await items.aclose()
+            await store_listings(db, batch)
+        tail = {"done": True, "total": total, "query": payload.query or ""}
+        if error:
+            tail["error"] = error
+        yield dumps(tail) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/scanner/pool")
+async def scanner_pool():
+    return _loaded_stats("app.marketplace.scanner", lambda m: m.browser_pool().stats())
+
+
+@app.get("/api/scanner/pages")
+async def scanner_pages():
+    return lean_stats.snapshot()
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return search_cache.stats()
+
+
+@app.get("/api/scanner/enrich")
+async def scanner_enrich():
+    return _loaded_stats("app.marketplace.enrich", lambda m: m.detail_enricher.stats())
+
+
+@app.get("/api/scanner/dedup")
+async def scanner_dedup():
+    return dedup_index.stats()
+
+
+# -----------------------------------------------------------------------------
+# Stored listings (Mongo)
+# -----------------------------------------------------------------------------
+@app.get("/api/listings")
+async def listings_query(q: Optional[str] = None, category: Optional[str] = None, city: Optional[str] = None,
+                         price_min: Optional[float] = None, price_max: Optional[float] = None,
+                         location: Optional[str] = None, radius: int = 25,
+                         sort_by: str = "date_desc", cursor: Optional[str] = None, limit: int = 50):
+    """Повторные/отфильтрованные запросы из сохранённых объявлений, без скрапинга."""
+    if db is None:
+        raise HTTPException(500, "Mongo not configured")
+    from bson.errors import InvalidId
+    from app.storage.listings import query_listings
+    await _until_storage_ready()   # индексы ($text, 2dsphere) создаются в _bootstrap
+    near = None
+    if location:
+        near = geocode(location)
+        if near is None:
+            raise HTTPException(400, f"Unknown location: {location}")
+    try:
+        with span("mongo_listings_query"):
+            page = await query_listings(db, q=q, category=category, city=city, price_min=price_min,
+                                        price_max=price_max, near=near, radius_miles=radius,
+                                        sort_by=sort_by, cursor=cursor, limit=limit)
+    except (ValueError, TypeError, InvalidId) as e:
+        raise HTTPException(400, f"Bad cursor: {e}")
+    return StreamingResponse(iter_json("listings", page["listings"], next_cursor=page["next_cursor"]),
+                             media_type="application/json")
+
+
+@app.get("/api/listings/{marketplace_id}/prices")
+async def listing_prices(marketplace_id: str):
+    """История цены объявления: точки только там, где цена менялась."""
+    if db is None:
+        raise HTTPException(500, "Mongo not configured")
+    from app.marketplace.prices import price_tracker
+    await _until_storage_ready()
+    points = await price_tracker.history(marketplace_id)
+    return {"marketplace_id": marketplace_id, "points": points,
+            "current": points[-1]["price"] if points else None}
+
+
 # -----------------------------------------------------------------------------
 # Saved searches (Mongo)
 # -----------------------------------------------------------------------------
@@ -329,8 +519,27 @@ async def api_search(payload: SearchRequest):
 async def saved_all():
     if not db:
         return []
-    cur = db.saved_searches.find().sort("created_at", -1)
-    return [{**x, "_id": str(x.get("_id"))} async for x in cur]
+    from app.marketplace.velocity import SCAN_INTERVAL_MINUTES
+    with span("mongo_saved_list"):
+        cur = db.saved_searches.find().sort("created_at", -1)
+        # interval_minutes/predicted_yield выставляет планировщик; до первого скана — значения по умолчанию
+        return [{"interval_minutes": SCAN_INTERVAL_MINUTES, "predicted_yield": None, "rate_per_hour": None,
+                 "priority": 1.0, **x, "_id": str(x.get("_id"))} async for x in cur]
+
+def _alert_mode(value: Any) -> str:
+    mode = value or "new"
+    if mode not in ALERT_MODES:
+        raise HTTPException(400, f"alert_mode must be one of {', '.join(ALERT_MODES)}")
+    return mode
+
+def _priority(value: Any) -> float:
+    try:
+        priority = float(1.0 if value is None else value)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "priority must be a number")
+    if not 0 < priority <= 100:
+        raise HTTPException(400, "priority must be in (0, 100]")
+    return priority
 
 @app.post("/api/saved")
 async def saved_create(body: Dict[str, Any]):
@@ -341,9 +550,12 @@ async def saved_create(body: Dict[str, Any]):
         "filters": body.get("filters", {}),
         "notifications_enabled": True,
         "notifications": {"email": False, "push": False},
+        "alert_mode": _alert_mode(body.get("alert_mode")),
+        "priority": _priority(body.get("priority")),
         "created_at": datetime.utcnow(),
     }
-    res = await db.saved_searches.insert_one(doc)
+    with span("mongo_saved_create"):
+        res = await db.saved_searches.insert_one(doc)
     doc["_id"] = str(res.inserted_id)
     return doc
 
@@ -352,38 +564,79 @@ async def saved_patch(sid: str, body: Dict[str, Any]):
     if not db:
         raise HTTPException(500, "Mongo not configured")
     from bson import ObjectId
-    await db.saved_searches.update_one(
-        {"_id": ObjectId(sid)},
-        {"$set": {f"notifications.{k}": v for k, v in body.items()}},
-    )
-    doc = await db.saved_searches.find_one({"_id": ObjectId(sid)})
+    with span("mongo_saved_update"):
+        await db.saved_searches.update_one(
+            {"_id": ObjectId(sid)},
+            {"$set": {f"notifications.{k}": v for k, v in body.items()}},
+        )
+        doc = await db.saved_searches.find_one({"_id": ObjectId(sid)})
     return doc.get("notifications", {})
 
+@app.patch("/api/saved/{sid}/alert_mode")
+async def saved_alert_mode(sid: str, body: Dict[str, Any]):
+    """{"alert_mode": "new" | "price_drop" | "both"}"""
+    if not db:
+        raise HTTPException(500, "Mongo not configured")
+    from bson import ObjectId
+    mode = _alert_mode(body.get("alert_mode"))
+    with span("mongo_saved_update"):
+        await db.saved_searches.update_one({"_id": ObjectId(sid)}, {"$set": {"alert_mode": mode}})
+    return {"alert_mode": mode}
+
+@app.patch("/api/saved/{sid}/priority")
+async def saved_priority(sid: str, body: Dict[str, Any]):
+    """{"priority": 2} — вдвое большая доля бюджета сканов, когда его не хватает всем."""
+    if not db:
+        raise HTTPException(500, "Mongo not configured")
+    from bson import ObjectId
+    priority = _priority(body.get("priority"))
+    with span("mongo_saved_update"):
+        await db.saved_searches.update_one({"_id": ObjectId(sid)}, {"$set": {"priority": priority}})
+    return {"priority": priority}
+
 @app.delete("/api/saved/{sid}")
 async def saved_delete(sid: str):
     if not db:
         raise HTTPException(500, "Mongo not configured")
     from bson import ObjectId
-    await db.saved_searches.delete_one({"_id": ObjectId(sid)})
+    from app.storage.seen import forget_search
+    with span("mongo_saved_delete"):
+        await db.saved_searches.delete_one({"_id": ObjectId(sid)})
+        await forget_search(db, sid)
     return {"ok": True}
 
 # -----------------------------------------------------------------------------
-# Periodic notifications example
+# Periodic scans (запускаются в _start_scanner при SCAN_IN_API=1)
 # -----------------------------------------------------------------------------
-@scheduler.scheduled_job("interval", minutes=10)
-async def periodic_scan():
-    if not db:
-        return
-    async for ss in db.saved_searches.find({"notifications_enabled": True}):
-        try:
-            items = search_marketplace(ss.get("query", ""), ss.get("filters", {}))
-            if items:
-                title = items[0]["title"]
-                push("Marketplace Finder", f"New item: {title}")
-                send_email(
-                    os.getenv("SMTP_USER") or "you@example.com",
-                    "New Marketplace item",
-                    title,
-                )
-        except Exception as e:
-            print(f"[periodic_scan error] {e}")
+@app.get("/api/scanner/scheduler")
+async def scanner_scheduler():
+    if scan_scheduler is None:
+        return {"enabled": False}
+    return await scan_scheduler.stats()
+
+@app.get("/api/notifications/stats")
+async def notifications_stats():
+    return _loaded_stats("app.notifications.dispatcher", lambda m: m.dispatcher.stats())
+
+# -----------------------------------------------------------------------------
+# Prometheus: гистограммы стадий (mpf_stage_seconds), HTTP, ошибки + состояние компонентов
+# -----------------------------------------------------------------------------
+registry.gauge("mpf_browser_pool", "Browser pool state",
+               lambda: _loaded_stats("app.marketplace.scanner", lambda m: m.browser_pool().stats()), "key")
+registry.gauge("mpf_search_cache", "Search cache state", search_cache.stats, "key")
+registry.gauge("mpf_pages", "Scraper page traffic (lean mode)", lean_stats.snapshot, "key")
+registry.gauge("mpf_enrich", "Detail-page enrichment: cache hits, fetched, failed",
+               lambda: _loaded_stats("app.marketplace.enrich", lambda m: m.detail_enricher.stats()), "key")
+registry.gauge("mpf_prices", "Price tracking: observed/changes/drops, tracked listings",
+               lambda: _loaded_stats("app.marketplace.prices", lambda m: m.price_tracker.stats()), "key")
+registry.gauge("mpf_dedup", "Near-duplicate index: seen/duplicates/clusters/notify_suppressed", dedup_index.stats, "key")
+registry.gauge("mpf_notifications", "Notification dispatcher state",
+               lambda: _loaded_stats("app.notifications.dispatcher", lambda m: m.dispatcher.stats()), "key")
+registry.gauge("mpf_scan_scheduler", "Scan producer/worker counters of this process",
+               lambda: scan_scheduler.counters() if scan_scheduler is not None else {}, "key")
+registry.gauge("mpf_sessions_available", "Facebook accounts not cooling down",
+               lambda: sum(1 for a in session_pool.accounts.values() if a.available(time.monotonic())))
+
+@app.get("/api/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
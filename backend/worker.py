@@ -0,0 +1,84 @@
+"""
+Отдельный процесс сканера сохранённых поисков (без HTTP API):
+
+    cd backend && python worker.py
+
+Таких процессов можно запустить сколько угодно и на разных машинах: задачи берутся
+из общей очереди scan_jobs в Mongo, producer работает только в процессе-лидере.
+API при этом можно запустить с SCAN_IN_API=0, чтобы он не скрапил сам.
+"""
+import asyncio
+import os
+import signal
+from functools import partial
+
+from dotenv import load_dotenv
+
+from app.marketplace.cache import search_cache
+from app.marketplace.dedup import dedup_index
+from app.marketplace.pipeline import scan_group
+from app.marketplace.prices import price_tracker
+from app.marketplace.scan_scheduler import ScanScheduler, SCAN_TICK_SECONDS
+from app.marketplace.scanner import browser_pool
+from app.marketplace.session import session_pool
+from app.notifications.dispatcher import dispatcher
+from app.storage.listings import ensure_listing_indexes
+from app.storage.mongo import connect
+from app.storage.seen import ensure_seen_indexes
+
+
+async def _produce(scan_scheduler: ScanScheduler, db, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await scan_scheduler.tick(db)
+        except Exception as e:
+            print(f"[scan producer error] {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), SCAN_TICK_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    load_dotenv()
+    mongo_url = os.getenv("MONGO_URL")
+    if not mongo_url:
+        raise SystemExit("MONGO_URL is required for the scan worker")
+    db = connect(mongo_url)
+
+    await session_pool.load(db)
+    session_pool.start_watch()   # cookies, загруженные через API, доходят до воркера без перезапуска
+    await browser_pool().start()
+    await search_cache.attach_db(db)
+    await dedup_index.attach_db(db)
+    await price_tracker.attach_db(db)
+    await dispatcher.start()
+    await ensure_seen_indexes(db)
+    await ensure_listing_indexes(db)
+
+    scan_scheduler = ScanScheduler(partial(scan_group, db), saturated=lambda: browser_pool().saturated())
+    await scan_scheduler.attach_db(db)
+    print(f"[worker] {scan_scheduler.worker_id} started")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    producer = asyncio.create_task(_produce(scan_scheduler, db, stop))
+    consumer = asyncio.create_task(scan_scheduler.run_worker(db))
+    await stop.wait()
+
+    print("[worker] stopping")
+    await scan_scheduler.stop()
+    for t in (producer, consumer):
+        t.cancel()
+    await asyncio.gather(producer, consumer, return_exceptions=True)
+    await dispatcher.stop()
+    session_pool.stop_watch()
+    await session_pool.flush()
+    await browser_pool().close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())